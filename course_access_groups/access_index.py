@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+"""
+Compiled in-memory index of the group courses of each organization.
+"""
+
+import time
+
+from django.conf import settings
+
+from .cache import DEFAULT_CACHE_TIMEOUT, LRUCache, TwoTierCache
+from .models import GroupCourse
+
+DEFAULT_ACCESS_INDEX_SIZE = 256  # Organizations per process
+
+index_versions_cache = TwoTierCache('access_index_version')
+
+
+class OrganizationAccessIndex:
+    """
+    Group to course index of an organization compiled into bitsets.
+
+    Each course of the organization gets a dense bit position, and the courses of each group are stored as a
+    Python int bitset. Checking a group course is a single bit test, and checking many courses is a bitwise AND.
+    """
+
+    def __init__(self, version, course_positions, group_bitsets):
+        self.version = version
+        self.course_positions = course_positions
+        self.course_ids = sorted(course_positions, key=course_positions.get)
+        self.group_bitsets = group_bitsets
+
+    @classmethod
+    def build(cls, organization_id, version):
+        """
+        Compile the index of an organization with a single query.
+
+        :param organization_id: Organization primary key.
+        :param version: The organization index version read before building the index.
+        :return: OrganizationAccessIndex.
+        """
+        course_positions = {}
+        group_bitsets = {}
+        group_courses = GroupCourse.objects.filter(group__organization_id=organization_id)
+        for group_id, course_id in group_courses.values_list('group_id', 'course_id').iterator():
+            position = course_positions.setdefault(str(course_id), len(course_positions))
+            group_bitsets[group_id] = group_bitsets.get(group_id, 0) | (1 << position)
+        return cls(version, course_positions, group_bitsets)
+
+    def has_course(self, group_id, course_id_str):
+        """
+        Check if the course belongs to the group.
+
+        :param group_id: CourseAccessGroup primary key.
+        :param course_id_str: Course id string.
+        :return: bool.
+        """
+        position = self.course_positions.get(course_id_str)
+        if position is None:
+            return False
+        return bool((self.group_bitsets.get(group_id, 0) >> position) & 1)
+
+    def filter_courses(self, group_id, course_id_strs):
+        """
+        Get the courses which belongs to the group out of the given courses.
+
+        :param group_id: CourseAccessGroup primary key.
+        :param course_id_strs: Iterable of course id strings.
+        :return: set of course id strings.
+        """
+        courses_bitset = 0
+        for course_id_str in course_id_strs:
+            position = self.course_positions.get(course_id_str)
+            if position is not None:
+                courses_bitset |= 1 << position
+        return self._decode(self.group_bitsets.get(group_id, 0) & courses_bitset)
+
+    def get_group_course_ids(self, group_id):
+        """
+        Get all of the group courses.
+
+        :param group_id: CourseAccessGroup primary key.
+        :return: set of course id strings.
+        """
+        return self._decode(self.group_bitsets.get(group_id, 0))
+
+    def _decode(self, bitset):
+        """
+        Convert a bitset into course id strings.
+        """
+        course_ids = set()
+        while bitset:
+            lowest_bit = bitset & -bitset
+            course_ids.add(self.course_ids[lowest_bit.bit_length() - 1])
+            bitset ^= lowest_bit
+        return course_ids
+
+
+# Versions are checked on every access, so the timeout is only needed to free the memory of idle organizations.
+_indexes = LRUCache(
+    maxsize=getattr(settings, 'COURSE_ACCESS_GROUPS_ACCESS_INDEX_SIZE', DEFAULT_ACCESS_INDEX_SIZE),
+    timeout=DEFAULT_CACHE_TIMEOUT,
+)
+
+
+def get_organization_access_index(organization_id):
+    """
+    Get the up-to-date compiled index of the organization, building it lazily.
+
+    Indexes are kept in a bounded in-process cache and rebuilt once the organization version changes.
+
+    :param organization_id: Organization primary key.
+    :return: OrganizationAccessIndex.
+    """
+    version = get_organization_index_version(organization_id)
+    index = _indexes.get(organization_id)
+    if index is None or index.version != version:
+        index = OrganizationAccessIndex.build(organization_id, version)
+        _indexes.set(organization_id, index)
+    return index
+
+
+def get_organization_index_version(organization_id):
+    """
+    Get the version of the organization index.
+
+    :param organization_id: Organization primary key.
+    :return: int.
+    """
+    version = index_versions_cache.get(organization_id)
+    if version is None:
+        version = _new_version()
+        index_versions_cache.set(organization_id, version)
+    return version
+
+
+def invalidate_organization_access_index(organization_id):
+    """
+    Bump the organization index version so all processes rebuild it.
+
+    :param organization_id: Organization primary key.
+    """
+    index_versions_cache.set(organization_id, _new_version())
+    _indexes.delete(organization_id)
+
+
+def _new_version():
+    """
+    Time-based versions avoid reusing old versions after cache evictions.
+    """
+    return int(time.time() * 1000000)
@@ -4,8 +4,11 @@ Course Access Groups Django application initialization.
 """
 
 from django.apps import AppConfig
+from django.core.signals import request_finished, request_started
 from openedx.core.djangoapps.plugins.constants import PluginSignals, PluginURLs, ProjectType
 
+from .cache import clear_request_cache, start_request_cache
+
 
 class CourseAccessGroupsConfig(AppConfig):
     """
@@ -37,3 +40,15 @@ class CourseAccessGroupsConfig(AppConfig):
             }
         },
     }
+
+    def ready(self):
+        """
+        Connect the request cache and the model signal receivers, and read the static settings.
+        """
+        from . import signals  # noqa: F401 -- Registers the model receivers.
+        from .feature_flag import load_organizations_app_setting
+
+        load_organizations_app_setting()
+
+        request_started.connect(start_request_cache, dispatch_uid='course_access_groups.start_request_cache')
+        request_finished.connect(clear_request_cache, dispatch_uid='course_access_groups.clear_request_cache')
@@ -0,0 +1,315 @@
+# -*- coding: utf-8 -*-
+"""
+Caching helpers for Course Access Groups.
+"""
+
+import threading
+import time
+from collections import Counter, OrderedDict
+from functools import partial
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+CACHE_KEY_PREFIX = 'course_access_groups'
+DEFAULT_CACHE_TIMEOUT = 60 * 60  # Invalidation is signal-driven, the timeout is only a safety net.
+DEFAULT_LOCAL_CACHE_SIZE = 1024
+DEFAULT_LOCAL_CACHE_TIMEOUT = 30  # Signals only invalidate the current process, this bounds staleness of others.
+DEFAULT_ADMIN_CACHE_TIMEOUT = 5 * 60  # Promotions via `QuerySet.update` send no signals, only the timeout applies.
+DEFAULT_COUNT_CACHE_TIMEOUT = 5 * 60  # Estimated list counts aren't invalidated, they're refreshed on expiry.
+
+_request_cache = threading.local()
+_local_caches = []
+_two_tier_caches = []
+
+
+def get_cache_key(*parts):
+    """
+    Build a Django cache key for Course Access Groups data.
+
+    :param parts: Strings or objects with meaningful `str()` such as CourseKey.
+    :return: str e.g. `course_access_groups.public_courses.my_org`.
+    """
+    return '.'.join([CACHE_KEY_PREFIX] + [str(part) for part in parts])
+
+
+def get_cache_timeout():
+    """
+    Get the timeout of the shared (Django) cache entries from the `COURSE_ACCESS_GROUPS_CACHE_TIMEOUT` setting.
+
+    :return: int: Seconds.
+    """
+    return getattr(settings, 'COURSE_ACCESS_GROUPS_CACHE_TIMEOUT', DEFAULT_CACHE_TIMEOUT)
+
+
+def get_admin_cache_timeout():
+    """
+    Get the timeout of the cached organization admin checks from the `COURSE_ACCESS_GROUPS_ADMIN_CACHE_TIMEOUT` setting.
+
+    :return: int: Seconds.
+    """
+    return getattr(settings, 'COURSE_ACCESS_GROUPS_ADMIN_CACHE_TIMEOUT', DEFAULT_ADMIN_CACHE_TIMEOUT)
+
+
+def get_count_cache_timeout():
+    """
+    Get the timeout of the cached estimated list counts from the `COURSE_ACCESS_GROUPS_COUNT_CACHE_TIMEOUT` setting.
+
+    :return: int: Seconds.
+    """
+    return getattr(settings, 'COURSE_ACCESS_GROUPS_COUNT_CACHE_TIMEOUT', DEFAULT_COUNT_CACHE_TIMEOUT)
+
+
+def get_local_cache_size():
+    """
+    Get the maximum entries of each in-process cache from the `COURSE_ACCESS_GROUPS_LOCAL_CACHE_SIZE` setting.
+
+    :return: int.
+    """
+    return getattr(settings, 'COURSE_ACCESS_GROUPS_LOCAL_CACHE_SIZE', DEFAULT_LOCAL_CACHE_SIZE)
+
+
+def get_local_cache_timeout():
+    """
+    Get the timeout of the in-process cache entries from the `COURSE_ACCESS_GROUPS_LOCAL_CACHE_TIMEOUT` setting.
+
+    :return: int: Seconds.
+    """
+    return getattr(settings, 'COURSE_ACCESS_GROUPS_LOCAL_CACHE_TIMEOUT', DEFAULT_LOCAL_CACHE_TIMEOUT)
+
+
+def get_request_cache():
+    """
+    Get the cache dictionary of the request being processed in the current thread.
+
+    The cache lives from the `request_started` to the `request_finished` Django signals. Outside a request
+    (e.g. management commands and celery tasks) there's no cache and `None` is returned, so callers
+    should always evaluate without memoization in such case.
+
+    :return: dict or None.
+    """
+    return getattr(_request_cache, 'data', None)
+
+
+def start_request_cache(**kwargs):
+    """
+    Receive the `request_started` signal to start an empty request cache.
+    """
+    _request_cache.data = {}
+
+
+def clear_request_cache(**kwargs):
+    """
+    Receive the `request_finished` signal to discard the request cache.
+    """
+    _request_cache.data = None
+
+
+def reset_request_cache():
+    """
+    Empty the current request cache, if any, to discard decisions which are made stale by data changes.
+    """
+    if get_request_cache() is not None:
+        _request_cache.data = {}
+
+
+def invalidate_on_commit(invalidate, *args):
+    """
+    Call a cache invalidation function now and once again after the current transaction commits, if any.
+
+    Until the transaction commits other processes still read the old rows and may cache them again, the second
+    invalidation discards these stale entries.
+
+    :param invalidate: Invalidation function e.g. `invalidate_user_group`.
+    :param args: The invalidation function arguments.
+    """
+    invalidate(*args)
+    if transaction.get_connection().in_atomic_block:
+        transaction.on_commit(partial(invalidate, *args))
+
+
+class LRUCache:
+    """
+    Bounded in-process cache with least-recently-used eviction and per-entry expiry.
+
+    Useful to avoid cache server round-trips for hot entries. Since invalidation only affects the current process,
+    the timeout should be kept short.
+
+    The size and timeout default to the `COURSE_ACCESS_GROUPS_LOCAL_CACHE_*` settings.
+    """
+
+    def __init__(self, maxsize=None, timeout=None):
+        self._maxsize = maxsize
+        self._timeout = timeout
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        _local_caches.append(self)
+
+    def get(self, key, default=None):
+        """
+        Get an unexpired value from the cache.
+        """
+        with self._lock:
+            try:
+                expires_at, value = self._data[key]
+            except KeyError:
+                return default
+
+            if expires_at < time.monotonic():
+                del self._data[key]
+                return default
+
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        """
+        Add a value to the cache and evict the least recently used value if the cache is full.
+        """
+        timeout = get_local_cache_timeout() if self._timeout is None else self._timeout
+        maxsize = get_local_cache_size() if self._maxsize is None else self._maxsize
+        with self._lock:
+            self._data[key] = (time.monotonic() + timeout, value)
+            self._data.move_to_end(key)
+            while len(self._data) > maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        """
+        Remove a value from the cache, if any.
+        """
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        """
+        Remove all values from the cache.
+        """
+        with self._lock:
+            self._data.clear()
+
+
+class TwoTierCache:
+    """
+    In-process LRUCache in front of the shared Django cache.
+
+    Hot entries are served from the current process without a round-trip to the cache server. Changes invalidate
+    both tiers in the current process, while other processes see them once their local entries expire.
+
+    Values must not be `None` which is indistinguishable from cache misses.
+
+    The shared tier timeout defaults to the `COURSE_ACCESS_GROUPS_CACHE_TIMEOUT` setting, `timeout` is a callable
+    to override it for data which isn't fully covered by signals.
+    """
+
+    def __init__(self, name, timeout=None):
+        self.name = name
+        self._get_timeout = timeout or get_cache_timeout
+        self.local_cache = LRUCache()
+        self.stats = Counter()
+        _two_tier_caches.append(self)
+
+    def get_shared_key(self, key):
+        """
+        Build the shared cache key of an entry e.g. `course_access_groups.public_courses.my_org`.
+        """
+        return get_cache_key(self.name, key)
+
+    def get(self, key):
+        """
+        Get the value from the local tier, or the shared tier on local misses.
+
+        :param key: Entry key within this cache e.g. an organization name or a user id.
+        :return: The cached value or `None`.
+        """
+        shared_key = self.get_shared_key(key)
+        value = self.local_cache.get(shared_key)
+        if value is not None:
+            self.stats['local_hits'] += 1
+            return value
+
+        self.stats['local_misses'] += 1
+        value = cache.get(shared_key)
+        if value is None:
+            self.stats['shared_misses'] += 1
+        else:
+            self.stats['shared_hits'] += 1
+            self.local_cache.set(shared_key, value)
+        return value
+
+    def get_many(self, keys):
+        """
+        Bulk version of `get` which queries the shared tier once for all local misses.
+
+        :param keys: List of entry keys.
+        :return: dict: {key: value} for the cached entries only.
+        """
+        values = {}
+        shared_keys = {}
+        for key in keys:
+            shared_key = self.get_shared_key(key)
+            value = self.local_cache.get(shared_key)
+            if value is None:
+                shared_keys[shared_key] = key
+            else:
+                values[key] = value
+
+        self.stats['local_hits'] += len(values)
+        self.stats['local_misses'] += len(shared_keys)
+        if shared_keys:
+            shared_values = cache.get_many(list(shared_keys))
+            self.stats['shared_hits'] += len(shared_values)
+            self.stats['shared_misses'] += len(shared_keys) - len(shared_values)
+            for shared_key, value in shared_values.items():
+                self.local_cache.set(shared_key, value)
+                values[shared_keys[shared_key]] = value
+
+        return values
+
+    def set(self, key, value):
+        """
+        Store the value in both tiers.
+
+        :param key: Entry key within this cache.
+        :param value: Any picklable value except `None`.
+        """
+        shared_key = self.get_shared_key(key)
+        cache.set(shared_key, value, self._get_timeout())
+        self.local_cache.set(shared_key, value)
+
+    def set_many(self, values):
+        """
+        Bulk version of `set`.
+
+        :param values: dict: {key: value}.
+        """
+        shared_values = {self.get_shared_key(key): value for key, value in values.items()}
+        cache.set_many(shared_values, self._get_timeout())
+        for shared_key, value in shared_values.items():
+            self.local_cache.set(shared_key, value)
+
+    def delete(self, key):
+        """
+        Remove the value from both tiers.
+        """
+        shared_key = self.get_shared_key(key)
+        cache.delete(shared_key)
+        self.local_cache.delete(shared_key)
+
+
+def get_cache_stats():
+    """
+    Get the hit and miss counters of each tier since the process started.
+
+    :return: dict e.g. `{'public_courses': {'local_hits': 10, 'local_misses': 2, 'shared_hits': 1, ...}}`.
+    """
+    return {two_tier_cache.name: dict(two_tier_cache.stats) for two_tier_cache in _two_tier_caches}
+
+
+def clear_local_caches():
+    """
+    Clear all of the in-process caches, mainly for tests.
+    """
+    for local_cache in _local_caches:
+        local_cache.clear()
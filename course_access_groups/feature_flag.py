@@ -4,9 +4,14 @@ Feature helpers.
 
 
 from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
 
+from .cache import get_request_cache
 from .openedx_modules import configuration_helpers
 
+_is_organizations_app_enabled = False
+
 
 class ConfigurationError(Exception):
     """
@@ -15,20 +20,66 @@ class ConfigurationError(Exception):
     pass
 
 
+def load_organizations_app_setting():
+    """
+    Read the `ORGANIZATIONS_APP` feature once instead of on every access check.
+
+    Called from `CourseAccessGroupsConfig.ready`.
+    """
+    global _is_organizations_app_enabled
+    # Keep the line below in sync with `util.organizations_helpers.organizations_enabled`
+    _is_organizations_app_enabled = bool(settings.FEATURES.get('ORGANIZATIONS_APP', False))
+
+
+@receiver(setting_changed)
+def on_setting_changed(setting, **kwargs):
+    """
+    Reload `ORGANIZATIONS_APP` when the `FEATURES` setting is overridden e.g. in tests.
+    """
+    if setting == 'FEATURES':
+        load_organizations_app_setting()
+
+
 def is_feature_enabled():
     """
     Helper to check Site Configuration for ENABLE_COURSE_ACCESS_GROUPS.
 
+    The value is memoized for the rest of the request, which is scoped to a single site.
+
     :return: bool
     """
+    request_cache = get_request_cache()
+    if request_cache is not None and 'is_feature_enabled' in request_cache:
+        return request_cache['is_feature_enabled']
+
     is_enabled = bool(configuration_helpers.get_value('ENABLE_COURSE_ACCESS_GROUPS', default=False))
 
     if is_enabled:
-        # Keep the line below in sync with `util.organizations_helpers.organizations_enabled`
-        if not settings.FEATURES.get('ORGANIZATIONS_APP', False):
+        if not _is_organizations_app_enabled:
             raise ConfigurationError(
                 'The Course Access Groups feature is enabled but the Oragnizations App is not. '
                 'Please enable the feature flag `ORGANIZATIONS_APP` to fix this exception.'
             )
 
+    if request_cache is not None:
+        request_cache['is_feature_enabled'] = is_enabled
+
     return is_enabled
+
+
+def is_access_materialization_enabled():
+    """
+    Helper to check the COURSE_ACCESS_GROUPS_MATERIALIZE_ACCESS setting for the `UserCourseAccess` table.
+
+    :return: bool
+    """
+    return bool(getattr(settings, 'COURSE_ACCESS_GROUPS_MATERIALIZE_ACCESS', False))
+
+
+def is_deferred_membership_rules_enabled():
+    """
+    Helper to check the COURSE_ACCESS_GROUPS_DEFER_MEMBERSHIP_RULES setting for background MembershipRule processing.
+
+    :return: bool
+    """
+    return bool(getattr(settings, 'COURSE_ACCESS_GROUPS_DEFER_MEMBERSHIP_RULES', False))
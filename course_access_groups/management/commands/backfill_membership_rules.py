@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+"""
+Management command to apply MembershipRule to existing users.
+"""
+
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from organizations.models import Organization
+
+from course_access_groups.membership_rules import DEFAULT_BATCH_SIZE, backfill_organization_memberships
+
+
+class Command(BaseCommand):
+    """
+    Assign existing users without a Membership to groups according to the MembershipRule of their organization.
+    """
+
+    help = 'Apply the MembershipRule of organizations to their existing users.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--organization',
+            action='append',
+            dest='organizations',
+            default=[],
+            help='Organization short name. Can be repeated, defaults to all organizations.',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=DEFAULT_BATCH_SIZE,
+            help='Number of users per query and per insert transaction.',
+        )
+
+    def handle(self, *args, **options):
+        organizations = Organization.objects.all()
+        if options['organizations']:
+            organizations = organizations.filter(short_name__in=options['organizations'])
+            missing_names = set(options['organizations']) - set(organizations.values_list('short_name', flat=True))
+            if missing_names:
+                raise CommandError('Organizations not found: {}'.format(', '.join(sorted(missing_names))))
+
+        for organization in organizations:
+            started_at = time.monotonic()
+
+            def report_progress(processed_count, assigned_count):
+                elapsed = max(time.monotonic() - started_at, 0.001)
+                self.stdout.write(
+                    'Organization "{name}": processed {processed} users, assigned {assigned} '
+                    '({rate:.0f} users/second).'.format(
+                        name=organization.short_name,
+                        processed=processed_count,
+                        assigned=assigned_count,
+                        rate=processed_count / elapsed,
+                    )
+                )
+
+            processed_count, assigned_count = backfill_organization_memberships(
+                organization,
+                batch_size=options['batch_size'],
+                progress_callback=report_progress,
+            )
+            self.stdout.write(
+                'Assigned {assigned} of {processed} users without a group in organization "{name}".'.format(
+                    assigned=assigned_count,
+                    processed=processed_count,
+                    name=organization.short_name,
+                )
+            )
@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+"""
+Management command to rebuild the materialized `UserCourseAccess` table.
+"""
+
+from django.core.management.base import BaseCommand, CommandError
+from organizations.models import Organization
+
+from course_access_groups.materialized_access import DEFAULT_BATCH_SIZE, rebuild_organization_access
+
+
+class Command(BaseCommand):
+    """
+    Rebuild the `UserCourseAccess` rows from scratch for one or all organizations.
+    """
+
+    help = 'Rebuild the materialized UserCourseAccess table of organizations.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--organization',
+            action='append',
+            dest='organizations',
+            default=[],
+            help='Organization short name. Can be repeated, defaults to all organizations.',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=DEFAULT_BATCH_SIZE,
+            help='Number of rows per insert query.',
+        )
+
+    def handle(self, *args, **options):
+        organizations = Organization.objects.all()
+        if options['organizations']:
+            organizations = organizations.filter(short_name__in=options['organizations'])
+            missing_names = set(options['organizations']) - set(organizations.values_list('short_name', flat=True))
+            if missing_names:
+                raise CommandError('Organizations not found: {}'.format(', '.join(sorted(missing_names))))
+
+        for organization in organizations:
+            count = rebuild_organization_access(organization, batch_size=options['batch_size'])
+            self.stdout.write('Rebuilt {count} access rows for organization "{name}".'.format(
+                count=count,
+                name=organization.short_name,
+            ))
@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+"""
+Helpers to maintain the materialized `UserCourseAccess` table.
+"""
+
+from django.db import transaction
+from organizations.models import OrganizationCourse
+
+from .models import CourseAccessGroup, GroupCourse, Membership, PublicCourse, UserCourseAccess
+
+DEFAULT_BATCH_SIZE = 1000
+
+
+def _bulk_grant(user_ids, course_ids, reason, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Insert the missing access rows for every user and course combination in batches.
+
+    :return: int: The number of rows attempted, including already existing ones.
+    """
+    course_ids = list(course_ids)
+    rows = []
+    count = 0
+    for user_id in user_ids:
+        for course_id in course_ids:
+            rows.append(UserCourseAccess(user_id=user_id, course_id=course_id, reason=reason))
+            if len(rows) >= batch_size:
+                UserCourseAccess.objects.bulk_create(rows, ignore_conflicts=True)
+                count += len(rows)
+                rows = []
+
+    if rows:
+        UserCourseAccess.objects.bulk_create(rows, ignore_conflicts=True)
+        count += len(rows)
+
+    return count
+
+
+def materialize_membership(membership):
+    """
+    Replace the group course rows of the user with the courses of the new membership group.
+    """
+    UserCourseAccess.objects.filter(user_id=membership.user_id, reason=UserCourseAccess.REASON_GROUP).delete()
+    course_ids = GroupCourse.objects.filter(group_id=membership.group_id).values_list('course_id', flat=True)
+    _bulk_grant([membership.user_id], course_ids, UserCourseAccess.REASON_GROUP)
+
+
+def dematerialize_membership(membership):
+    """
+    Remove the group course rows of the user.
+    """
+    UserCourseAccess.objects.filter(user_id=membership.user_id, reason=UserCourseAccess.REASON_GROUP).delete()
+
+
+def materialize_group_course(group_course):
+    """
+    Grant the course to all of the group members.
+    """
+    user_ids = Membership.objects.filter(group_id=group_course.group_id).values_list('user_id', flat=True)
+    _bulk_grant(user_ids.iterator(), [group_course.course_id], UserCourseAccess.REASON_GROUP)
+
+
+def dematerialize_group_course(group_course):
+    """
+    Revoke the course from all of the group members.
+    """
+    UserCourseAccess.objects.filter(
+        course_id=group_course.course_id,
+        reason=UserCourseAccess.REASON_GROUP,
+        user__membership__group_id=group_course.group_id,
+    ).delete()
+
+
+def materialize_public_course(public_course):
+    """
+    Add the user-less public course row.
+    """
+    UserCourseAccess.objects.get_or_create(
+        user=None,
+        course_id=public_course.course_id,
+        reason=UserCourseAccess.REASON_PUBLIC,
+    )
+
+
+def dematerialize_public_course(public_course):
+    """
+    Remove the user-less public course row.
+    """
+    UserCourseAccess.objects.filter(
+        user__isnull=True,
+        course_id=public_course.course_id,
+        reason=UserCourseAccess.REASON_PUBLIC,
+    ).delete()
+
+
+def rebuild_organization_access(organization, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Rebuild the `UserCourseAccess` rows of an organization from scratch.
+
+    :param organization: Organization object.
+    :param batch_size: Number of rows per insert query.
+    :return: int: The number of materialized rows.
+    """
+    organization_course_ids = OrganizationCourse.objects.filter(organization=organization).values('course_id')
+    groups = CourseAccessGroup.objects.filter(organization=organization)
+
+    with transaction.atomic():
+        UserCourseAccess.objects.filter(user__membership__group__in=groups).delete()
+        UserCourseAccess.objects.filter(course_id__in=organization_course_ids).delete()
+
+        public_course_ids = PublicCourse.objects.filter(
+            course_id__in=organization_course_ids,
+        ).values_list('course_id', flat=True)
+        count = _bulk_grant([None], public_course_ids, UserCourseAccess.REASON_PUBLIC, batch_size)
+
+        for group in groups:
+            course_ids = GroupCourse.objects.filter(group=group).values_list('course_id', flat=True)
+            user_ids = Membership.objects.filter(group=group).values_list('user_id', flat=True)
+            count += _bulk_grant(user_ids.iterator(), course_ids, UserCourseAccess.REASON_GROUP, batch_size)
+
+    return count
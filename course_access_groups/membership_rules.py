@@ -0,0 +1,383 @@
+# -*- coding: utf-8 -*-
+"""
+Helpers to apply MembershipRule to users in bulk.
+"""
+
+import logging
+import queue
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+from django.db import connections, transaction
+from django.db.models import CharField, Count, F, Q, Value
+from django.db.models.functions import Lower, StrIndex, Substr
+from organizations.models import Organization
+from tahoe_sites.api import get_users_of_organization
+from tahoe_sites.models import UserOrganizationMapping
+
+from . import materialized_access
+from .cache import invalidate_on_commit, reset_request_cache
+from .feature_flag import is_access_materialization_enabled
+from .models import Membership
+from .permissions import invalidate_user_group
+from .rule_index import get_email_domain_filter, get_membership_rule_index
+
+DEFAULT_BATCH_SIZE = 1000
+
+log = logging.getLogger(__name__)
+
+_pending_user_ids = queue.Queue()
+# A single worker keeps the batches large and the extra database connections to one per process.
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='course_access_groups_rules')
+
+
+def iterate_user_batches(users, batch_size=DEFAULT_BATCH_SIZE, fields=('email',)):
+    """
+    Stream (id, email) batches of a users queryset ordered by id.
+
+    Uses keyset pagination (`id > last_id`) so each batch is a cheap indexed query regardless of the table size,
+    and only a single batch is held in memory.
+
+    :param users: User queryset.
+    :param batch_size: Number of users per batch.
+    :param fields: The fields to fetch after the user id.
+    :return: Generator of lists of (id, email) tuples, or (id, *fields) tuples.
+    """
+    last_id = 0
+    while True:
+        batch = list(users.filter(pk__gt=last_id).order_by('pk').values_list('pk', *fields)[:batch_size])
+        if not batch:
+            return
+        yield batch
+        last_id = batch[-1][0]
+
+
+def is_changed_by_rules(current_group_id, automatic, group_id):
+    """
+    Check whether applying the rules would change the membership of a user.
+
+    Users without a membership are assigned, automatic memberships follow the rules and manual ones are kept.
+
+    :param current_group_id: The user membership group id, or None for users without a membership.
+    :param automatic: Whether the user membership was created by a MembershipRule.
+    :param group_id: The group id matched by the rules or None.
+    :return: bool.
+    """
+    if current_group_id is None:
+        return bool(group_id)
+    return automatic and group_id != current_group_id
+
+
+def bulk_create_automatic_memberships(memberships):
+    """
+    Insert automatic memberships skipping users who already have one.
+
+    The insert is safe under concurrent calls for the same users since conflicts on the `user` unique constraint
+    are ignored by the database. `bulk_create` skips the model signals, so the caches and materialized access rows
+    are updated here.
+
+    :param memberships: List of unsaved Membership objects.
+    """
+    Membership.objects.bulk_create(memberships, ignore_conflicts=True)
+
+    reset_request_cache()
+    for membership in memberships:
+        invalidate_on_commit(invalidate_user_group, membership.user_id)
+
+    if is_access_materialization_enabled():
+        for membership in Membership.objects.filter(user_id__in=[membership.user_id for membership in memberships]):
+            materialized_access.materialize_membership(membership)
+
+
+def backfill_organization_memberships(organization, batch_size=DEFAULT_BATCH_SIZE, progress_callback=None):
+    """
+    Assign the existing organization users without a Membership to groups according to the MembershipRule.
+
+    Users are streamed in batches and matched in memory against the compiled organization rules. Each batch is
+    inserted by its own `bulk_create` transaction to keep locks short on large organizations.
+
+    :param organization: Organization object.
+    :param batch_size: Number of users per query and per insert.
+    :param progress_callback: Optional callable receiving `(processed_count, assigned_count)` after each batch.
+    :return: tuple: (processed_count, assigned_count).
+    """
+    rule_index = get_membership_rule_index(organization.pk)
+    users = get_users_of_organization(organization=organization).filter(
+        is_active=True,  # Only users with verified emails, same as `Membership.create_from_rules`.
+        membership__isnull=True,
+    )
+
+    processed_count = 0
+    assigned_count = 0
+    if not rule_index.has_rules():
+        return processed_count, assigned_count
+
+    for batch in iterate_user_batches(users, batch_size=batch_size):
+        memberships = []
+        for user_id, email in batch:
+            group_id = rule_index.match_email(email)
+            if group_id:
+                memberships.append(Membership(user_id=user_id, group_id=group_id, automatic=True))
+
+        if memberships:
+            bulk_create_automatic_memberships(memberships)
+
+        processed_count += len(batch)
+        assigned_count += len(memberships)
+        if progress_callback:
+            progress_callback(processed_count, assigned_count)
+
+    return processed_count, assigned_count
+
+
+def apply_membership_rules(user_ids):
+    """
+    Assign the given users without a Membership to groups according to the MembershipRule.
+
+    Users and their organizations are fetched with a single query, and rules with at most one query per
+    organization on rule index cache misses.
+
+    :param user_ids: List of user ids.
+    :return: int: Number of assigned users.
+    """
+    user_organizations = UserOrganizationMapping.objects.filter(
+        user_id__in=user_ids,
+        user__is_active=True,  # Only users with verified emails, same as `Membership.create_from_rules`.
+        user__membership__isnull=True,
+    ).values_list('user_id', 'user__email', 'organization_id')
+
+    memberships = []
+    for user_id, email, organization_id in user_organizations:
+        group_id = get_membership_rule_index(organization_id).match_email(email)
+        if group_id:
+            memberships.append(Membership(user_id=user_id, group_id=group_id, automatic=True))
+
+    if memberships:
+        bulk_create_automatic_memberships(memberships)
+    return len(memberships)
+
+
+def defer_membership_rules(user_id):
+    """
+    Queue a user to have the MembershipRule applied in the background once the current transaction commits.
+
+    Used by the registration signal receivers when the `COURSE_ACCESS_GROUPS_DEFER_MEMBERSHIP_RULES` setting is
+    enabled, so the sign-up request doesn't wait for Course Access Groups queries.
+
+    :param user_id: The registered or activated user id.
+    """
+    transaction.on_commit(lambda: _enqueue_user(user_id))
+
+
+def _enqueue_user(user_id):
+    """
+    Add the user to the pending queue and wake up the worker.
+    """
+    _pending_user_ids.put(user_id)
+    _executor.submit(_run_worker, process_pending_users)
+
+
+def _run_worker(func, *args):
+    """
+    Run a background job in the worker thread.
+    """
+    try:
+        func(*args)
+    except Exception:
+        log.exception('Course Access Groups: Error running the background job %s%s', func.__name__, args)
+    finally:
+        # The worker thread owns its database connections, close them instead of leaving them idle.
+        connections.close_all()
+
+
+def process_pending_users(batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Drain the pending users queue in batches.
+
+    :param batch_size: Maximum users per batch.
+    :return: int: Number of processed users.
+    """
+    processed_count = 0
+    while True:
+        user_ids = []
+        while len(user_ids) < batch_size:
+            try:
+                user_ids.append(_pending_user_ids.get_nowait())
+            except queue.Empty:
+                break
+
+        if not user_ids:
+            return processed_count
+
+        try:
+            apply_membership_rules(user_ids)
+        except Exception:
+            log.exception('Course Access Groups: Error applying membership rules for users %s', user_ids)
+        processed_count += len(user_ids)
+
+
+def reevaluate_membership_rules(organization_id, domains, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Update the automatic memberships of the users matching the changed rule domains.
+
+    Users are streamed in batches and matched against the current organization rules. Automatic memberships are
+    moved to the new matching group or removed when no rule matches anymore, and users without a membership are
+    assigned. Manual memberships are never changed.
+
+    :param organization_id: Organization primary key.
+    :param domains: The old and new domains of the changed rules.
+    :param batch_size: Number of users per batch.
+    :return: dict: Counts of the `created`, `moved` and `removed` memberships.
+    """
+    counts = {'created': 0, 'moved': 0, 'removed': 0}
+    if not domains:
+        return counts
+
+    domains_filter = Q()
+    for domain in domains:
+        domains_filter |= get_email_domain_filter(domain)
+
+    organization = Organization.objects.get(pk=organization_id)
+    users = get_users_of_organization(organization=organization).filter(domains_filter)
+    rule_index = get_membership_rule_index(organization_id)
+
+    for batch in iterate_user_batches(users, batch_size=batch_size):
+        user_memberships = {
+            user_id: (membership_id, group_id, automatic)
+            for membership_id, user_id, group_id, automatic in Membership.objects.filter(
+                user_id__in=[user_id for user_id, _email in batch],
+            ).values_list('pk', 'user_id', 'group_id', 'automatic')
+        }
+
+        new_memberships = []
+        moved_membership_ids = defaultdict(list)  # {group_id: [membership_id]}
+        removed_membership_ids = []
+        for user_id, email in batch:
+            group_id = rule_index.match_email(email)
+            membership_id, current_group_id, automatic = user_memberships.get(user_id, (None, None, False))
+            if not is_changed_by_rules(current_group_id, automatic, group_id):
+                continue
+
+            if membership_id is None:
+                new_memberships.append(Membership(user_id=user_id, group_id=group_id, automatic=True))
+            elif group_id:
+                moved_membership_ids[group_id].append(membership_id)
+            else:
+                removed_membership_ids.append(membership_id)
+
+        if new_memberships:
+            bulk_create_automatic_memberships(new_memberships)
+            counts['created'] += len(new_memberships)
+
+        for group_id, membership_ids in moved_membership_ids.items():
+            _move_automatic_memberships(membership_ids, group_id)
+            counts['moved'] += len(membership_ids)
+
+        if removed_membership_ids:
+            # `QuerySet.delete` sends the `post_delete` signals which take care of the caches.
+            Membership.objects.filter(pk__in=removed_membership_ids, automatic=True).delete()
+            counts['removed'] += len(removed_membership_ids)
+
+    return counts
+
+
+def _move_automatic_memberships(membership_ids, group_id):
+    """
+    Move automatic memberships to another group.
+
+    `QuerySet.update` skips the model signals, so the caches and materialized access rows are updated here.
+    """
+    memberships = Membership.objects.filter(pk__in=membership_ids, automatic=True)
+    memberships.update(group_id=group_id)
+
+    reset_request_cache()
+    user_ids = list(memberships.values_list('user_id', flat=True))
+    for user_id in user_ids:
+        invalidate_on_commit(invalidate_user_group, user_id)
+
+    if is_access_materialization_enabled():
+        for membership in Membership.objects.filter(user_id__in=user_ids):
+            materialized_access.materialize_membership(membership)
+
+
+def schedule_membership_rules_reevaluation(organization_id, domains):
+    """
+    Queue `reevaluate_membership_rules` in the background once the current transaction commits.
+
+    :param organization_id: Organization primary key.
+    :param domains: The old and new domains of the changed rules.
+    """
+    domains = sorted(set(domains))
+    transaction.on_commit(lambda: _executor.submit(_run_worker, reevaluate_membership_rules, organization_id, domains))
+
+
+def get_users_count_by_domain(organization):
+    """
+    Count the organization users by email domain and current membership with a single aggregated query.
+
+    :param organization: Organization object.
+    :return: Queryset of dicts with the `email_domain`, `group_id`, `automatic` and `users` keys.
+    """
+    users = get_users_of_organization(organization=organization)
+    return users.annotate(
+        # The position is an integer, so the output field can't be resolved from the mixed source fields.
+        email_domain=Lower(Substr('email', StrIndex('email', Value('@')) + 1, output_field=CharField())),
+        group_id=F('membership__group_id'),
+        automatic=F('membership__automatic'),
+    ).values('email_domain', 'group_id', 'automatic').annotate(users=Count('pk')).order_by()
+
+
+def simulate_membership_rules(organization, rule_index):
+    """
+    Summarize the effect of replacing the organization rules with proposed ones, without writing anything.
+
+    Only the aggregated counts are fetched from the database, which keeps large organizations cheap.
+
+    :param organization: Organization object.
+    :param rule_index: MembershipRuleIndex of the proposed rules.
+    :return: dict with the `matched_users`, `changed_users`, `domains` and `changes` keys.
+    """
+    domain_counts = defaultdict(int)  # {email_domain: users}
+    change_counts = defaultdict(int)  # {(from_group_id, to_group_id): users}
+    for row in get_users_count_by_domain(organization):
+        group_id = rule_index.match(row['email_domain'])
+        if group_id:
+            domain_counts[row['email_domain']] += row['users']
+        if is_changed_by_rules(row['group_id'], row['automatic'], group_id):
+            change_counts[(row['group_id'], group_id)] += row['users']
+
+    return {
+        'matched_users': sum(domain_counts.values()),
+        'changed_users': sum(change_counts.values()),
+        'domains': [
+            {'domain': domain, 'users': users}
+            for domain, users in sorted(domain_counts.items())
+        ],
+        'changes': [
+            {'from_group': from_group_id, 'to_group': to_group_id, 'users': users}
+            for (from_group_id, to_group_id), users in sorted(change_counts.items(), key=lambda item: -item[1])
+        ],
+    }
+
+
+def iterate_simulated_changes(organization, rule_index, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Stream the users whose membership would change by replacing the organization rules with proposed ones.
+
+    :param organization: Organization object.
+    :param rule_index: MembershipRuleIndex of the proposed rules.
+    :param batch_size: Number of users per query.
+    :return: Generator of dicts with the `user_id`, `email`, `from_group` and `to_group` keys.
+    """
+    users = get_users_of_organization(organization=organization)
+    fields = ('email', 'membership__group_id', 'membership__automatic')
+    for batch in iterate_user_batches(users, batch_size=batch_size, fields=fields):
+        for user_id, email, current_group_id, automatic in batch:
+            group_id = rule_index.match_email(email)
+            if is_changed_by_rules(current_group_id, automatic, group_id):
+                yield {
+                    'user_id': user_id,
+                    'email': email,
+                    'from_group': current_group_id,
+                    'to_group': group_id,
+                }
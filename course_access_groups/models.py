@@ -66,22 +66,18 @@ class Membership(utils_models.TimeStampedModel):
             # If it does, look at the both the `Registration` class and the USER_ACCOUNT_ACTIVATED signal in Open edX.
             raise ValueError('Course Access Groups: Unable to create automatic Membership for inactive user.')
 
-        _, email_domain = user.email.rsplit('@', 1)
+        # Imported locally to avoid circular imports, the helper modules depend on the models.
+        from .membership_rules import bulk_create_automatic_memberships
+        from .rule_index import get_membership_rule_index
 
-        rule = MembershipRule.objects.filter(
-            domain=email_domain,
-            group__organization=get_organization_for_user(user),
-        ).first()
+        organization = get_organization_for_user(user)
+        group_id = get_membership_rule_index(organization.pk).match_email(user.email)
 
-        if rule:
-            membership, _created = cls.objects.get_or_create(
-                user=user,
-                defaults={
-                    'group': rule.group,
-                    'automatic': True,
-                },
-            )
-            return membership
+        if group_id:
+            # An INSERT which ignores existing memberships instead of `get_or_create` which races on the
+            # `user` unique constraint when the registration signals are delivered in parallel.
+            bulk_create_automatic_memberships([cls(user=user, group_id=group_id, automatic=True)])
+            return cls.objects.get(user=user)
 
 
 class MembershipRule(utils_models.TimeStampedModel):
@@ -120,3 +116,37 @@ class GroupCourse(utils_models.TimeStampedModel):
 
     class Meta:
         unique_together = ['course', 'group']
+
+
+class UserCourseAccess(utils_models.TimeStampedModel):
+    """
+    Materialized course access granted by the Course Access Groups rules.
+
+    This is an optional denormalized table for reporting and catalog filtering which is maintained by signals
+    when the `COURSE_ACCESS_GROUPS_MATERIALIZE_ACCESS` setting is enabled. Use the `rebuild_user_course_access`
+    management command to populate it or recover from drift.
+
+    Public courses are stored once without a user because they're accessible to everyone. Staff and organization
+    admins have access to all courses, therefore they're not materialized.
+    """
+
+    REASON_GROUP = 'group'
+    REASON_PUBLIC = 'public'
+    REASON_CHOICES = [
+        (REASON_GROUP, 'Group course of the user membership'),
+        (REASON_PUBLIC, 'Public course'),
+    ]
+
+    user = models.ForeignKey(
+        get_user_model(),
+        null=True,
+        blank=True,
+        related_name='course_accesses',
+        on_delete=models.CASCADE,
+        help_text='Learner, or empty for public courses.',
+    )
+    course = models.ForeignKey(CourseOverview, related_name='user_accesses', on_delete=models.CASCADE)
+    reason = models.CharField(max_length=16, choices=REASON_CHOICES)
+
+    class Meta:
+        unique_together = ['user', 'course', 'reason']
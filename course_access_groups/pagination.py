@@ -0,0 +1,152 @@
+"""
+DRF ViewSet pagination classes.
+"""
+
+import hashlib
+from collections import OrderedDict
+
+from django.utils.http import urlencode
+from rest_framework.pagination import CursorPagination, LimitOffsetPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+from .cache import TwoTierCache, get_count_cache_timeout
+from .permissions import get_requested_organization
+
+PAGINATION_QUERY_PARAM = 'pagination'
+
+estimated_counts_cache = TwoTierCache('estimated_count', timeout=get_count_cache_timeout)
+
+
+class IdCursorPagination(CursorPagination):
+    """
+    Cursor pagination on the stable `id` ordering which avoids the `COUNT(*)` and the deep `OFFSET` scans.
+    """
+
+    ordering = 'id'
+    page_size_query_param = 'limit'
+
+
+class HasMoreLimitOffsetPagination(LimitOffsetPagination):
+    """
+    Limit and offset pagination which fetches an extra object to tell if there's a next page instead of counting.
+    """
+
+    has_more = False
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.limit = self.get_limit(request)
+        if self.limit is None:
+            return None
+
+        self.offset = self.get_offset(request)
+        self.request = request
+        results = list(queryset[self.offset:self.offset + self.limit + 1])
+        self.has_more = len(results) > self.limit
+        # The page controls of the browsable API need the count.
+        self.display_page_controls = False
+        return results[:self.limit]
+
+    def get_next_link(self):
+        if not self.has_more:
+            return None
+
+        url = self.request.build_absolute_uri()
+        url = replace_query_param(url, self.limit_query_param, self.limit)
+        return replace_query_param(url, self.offset_query_param, self.offset + self.limit)
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('previous', self.get_previous_link()),
+            ('has_more', self.has_more),
+            ('results', data),
+        ]))
+
+
+class EstimatedCountLimitOffsetPagination(HasMoreLimitOffsetPagination):
+    """
+    Count-free pagination with an estimated `count` from a cached count of the same organization list and filters.
+
+    The cached count is refreshed once it expires after the `COURSE_ACCESS_GROUPS_COUNT_CACHE_TIMEOUT` setting.
+    """
+
+    def paginate_queryset(self, queryset, request, view=None):
+        page = super(EstimatedCountLimitOffsetPagination, self).paginate_queryset(queryset, request, view)
+        if page is not None:
+            cache_key = self.get_count_cache_key(request, view)
+            count = estimated_counts_cache.get(cache_key)
+            if count is None:
+                count = self.get_count(queryset)
+                estimated_counts_cache.set(cache_key, count)
+            # The cached count may be behind the objects that were just fetched.
+            self.count = max(count, self.offset + len(page) + int(self.has_more))
+        return page
+
+    def get_count_cache_key(self, request, view):
+        """
+        Get the estimated count cache key of the requested organization, view and filter parameters.
+
+        :return: str e.g. `12.UserViewSet.<md5 of the filter parameters>`.
+        """
+        pagination_params = {self.limit_query_param, self.offset_query_param, PAGINATION_QUERY_PARAM}
+        filter_params = sorted(
+            (param, values) for param, values in request.query_params.lists() if param not in pagination_params
+        )
+        filters_hash = hashlib.md5(urlencode(filter_params, doseq=True).encode('utf-8')).hexdigest()
+        return '{organization_id}.{view}.{filters_hash}'.format(
+            organization_id=get_requested_organization(request).pk,
+            view=type(view).__name__,
+            filters_hash=filters_hash,
+        )
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('count', self.count),
+            ('next', self.get_next_link()),
+            ('previous', self.get_previous_link()),
+            ('has_more', self.has_more),
+            ('results', data),
+        ]))
+
+
+class SelectablePagination(LimitOffsetPagination):
+    """
+    Limit and offset pagination with opt-in alternatives for large organizations.
+
+    Clients opt-in by using the `?pagination=` query parameter, the `next` links keep the parameter:
+
+        - `cursor`: Cursor pagination for syncing all the organization objects, without `count`.
+        - `has_more`: Limit and offset pagination with `has_more` instead of `count`.
+        - `estimate`: Limit and offset pagination with `has_more` and an estimated `count`.
+    """
+
+    pagination_query_param = PAGINATION_QUERY_PARAM
+    pagination_classes = {
+        'cursor': IdCursorPagination,
+        'has_more': HasMoreLimitOffsetPagination,
+        'estimate': EstimatedCountLimitOffsetPagination,
+    }
+
+    selected_paginator = None
+
+    def paginate_queryset(self, queryset, request, view=None):
+        pagination_class = self.pagination_classes.get(request.query_params.get(self.pagination_query_param))
+        if pagination_class:
+            self.selected_paginator = pagination_class()
+            page = self.selected_paginator.paginate_queryset(queryset, request, view)
+            self.display_page_controls = self.selected_paginator.display_page_controls
+            return page
+
+        self.selected_paginator = None
+        return super(SelectablePagination, self).paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        if self.selected_paginator:
+            return self.selected_paginator.get_paginated_response(data)
+        return super(SelectablePagination, self).get_paginated_response(data)
+
+    def to_html(self):
+        if self.selected_paginator:
+            return self.selected_paginator.to_html()
+        return super(SelectablePagination, self).to_html()
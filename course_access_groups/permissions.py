@@ -8,7 +8,8 @@ import logging
 
 from django.contrib.sites.models import Site
 from django.core.exceptions import MultipleObjectsReturned
-from organizations.models import Organization
+from django.db.models import Q
+from organizations.models import Organization, OrganizationCourse
 from rest_framework.authentication import BasicAuthentication, SessionAuthentication, TokenAuthentication
 from rest_framework.permissions import BasePermission, IsAuthenticated
 from rest_framework.exceptions import PermissionDenied
@@ -16,21 +17,37 @@ from tahoe_sites.api import (
     get_current_organization,
     get_organization_by_course,
     get_organization_by_uuid,
+    get_organization_for_user,
     is_active_admin_on_organization,
 )
 
-from .models import CourseAccessGroup, GroupCourse, Membership, PublicCourse
+from .access_index import get_organization_access_index
+from .cache import TwoTierCache, get_admin_cache_timeout, get_request_cache
+from .feature_flag import is_access_materialization_enabled
+from .models import GroupCourse, Membership, PublicCourse, UserCourseAccess
 from .openedx_modules import OAuth2Authentication
 
 log = logging.getLogger(__name__)
 
 
+COURSE_WITHOUT_ORGANIZATION = 'course_without_organization'
+COURSE_WITH_MULTIPLE_ORGANIZATIONS = 'course_with_multiple_organizations'
+USER_WITHOUT_MEMBERSHIP = 'user_without_membership'
+USER_NOT_ORGANIZATION_ADMIN = 'user_not_organization_admin'
+REQUESTED_ORGANIZATION_ATTRIBUTE = '_course_access_groups_requested_organization'
+
+course_organizations_cache = TwoTierCache('course_organization')
+public_courses_cache = TwoTierCache('public_courses')
+user_groups_cache = TwoTierCache('user_group')
+organization_admins_cache = TwoTierCache('organization_admin', timeout=get_admin_cache_timeout)
+
+
 def is_organization_staff(user, course):
     """
     Helper to check if the user is organization staff.
 
     Q: What if a course has two orgs?
-    A: No problem. This function raises `MultipleObjectsReturned`
+    A: No problem. The `get_course_organization` function raises `MultipleObjectsReturned`
 
     :param user: User to check access against.
     :param course: The Course or CourseOverview object to check access for.
@@ -42,18 +59,100 @@ def is_organization_staff(user, course):
         return False
 
     try:
-        course_organization = get_organization_by_course(course_id=course.id)
-    except Organization.DoesNotExist:
+        course_organization = get_course_organization(course.id)
+    except (Organization.DoesNotExist, MultipleObjectsReturned):
         # Safely handle the exception errors by assuming the user is not a staff.
         return False
+
+    return is_organization_admin(user, course_organization)
+
+
+def is_organization_admin(user, organization):
+    """
+    Version of `tahoe_sites.api.is_active_admin_on_organization` which caches the users who aren't admins.
+
+    Most checks are for learners who aren't admins, caching the answer saves a `UserOrganizationMapping` query per
+    check. Admins are always queried because `tahoe_sites.api.update_admin_role_in_organization` demotes them via
+    `QuerySet.update` which sends no signals. Cached entries are invalidated on `UserOrganizationMapping` signals, and
+    promotions without signals take effect once the entry expires after a short timeout.
+
+    :param user: User to check access against.
+    :param organization: Organization object.
+    :return: bool
+    """
+    if not user.is_active:
+        return False
+
+    cache_key = '{}.{}'.format(user.pk, organization.pk)
+    if organization_admins_cache.get(cache_key) == USER_NOT_ORGANIZATION_ADMIN:
+        return False
+
+    is_admin = is_active_admin_on_organization(user=user, organization=organization)
+    if not is_admin:
+        organization_admins_cache.set(cache_key, USER_NOT_ORGANIZATION_ADMIN)
+    return is_admin
+
+
+def invalidate_organization_admin(user_id, organization_id):
+    """
+    Remove the cached non-admin status of the user in the organization.
+    """
+    organization_admins_cache.delete('{}.{}'.format(user_id, organization_id))
+
+
+def get_course_organization(course_id):
+    """
+    Cached version of `tahoe_sites.api.get_organization_by_course`.
+
+    The organization of a course rarely changes, so it's cached in both of the in-process and the shared caches.
+    Misconfigured courses are cached as well to avoid repeated failing queries and log floods.
+
+    The cache is invalidated by the `OrganizationCourse` post_save and post_delete signals.
+
+    :param course_id: CourseKey object.
+    :raise Organization.DoesNotExist: When the course has no organization.
+    :raise MultipleObjectsReturned: When the course has more than one organization.
+    :return: Organization.
+    """
+    organization = course_organizations_cache.get(str(course_id))
+    if organization is None:
+        organization = _resolve_course_organization(course_id)
+        course_organizations_cache.set(str(course_id), organization)
+
+    if organization == COURSE_WITHOUT_ORGANIZATION:
+        raise Organization.DoesNotExist('Course Access Group: No organization for course ({})'.format(course_id))
+
+    if organization == COURSE_WITH_MULTIPLE_ORGANIZATIONS:
+        raise MultipleObjectsReturned('Course Access Group: Many organizations for course ({})'.format(course_id))
+
+    return organization
+
+
+def _resolve_course_organization(course_id):
+    """
+    Get the course organization from the database for `get_course_organization`.
+
+    :return: Organization, `COURSE_WITHOUT_ORGANIZATION` or `COURSE_WITH_MULTIPLE_ORGANIZATIONS`.
+    """
+    try:
+        return get_organization_by_course(course_id=course_id)
+    except Organization.DoesNotExist:
+        return COURSE_WITHOUT_ORGANIZATION
     except MultipleObjectsReturned:
         log.warning(
             'Course Access Group: This module expects a one:one relationship between organizations and course. '
-            'Raised by course (%s)', course.id
+            'Raised by course (%s)', course_id
         )
-        return False
+        return COURSE_WITH_MULTIPLE_ORGANIZATIONS
+
+
+def invalidate_course_organization(course_id):
+    """
+    Remove the course organization from the caches of `get_course_organization`.
 
-    return is_active_admin_on_organization(user=user, organization=course_organization)
+    :param course_id: CourseKey object or course id string.
+    """
+    course_organizations_cache.delete(str(course_id))
 
 
 def get_requested_organization(request):
@@ -67,18 +166,29 @@ def get_requested_organization(request):
     Note: In Tahoe terms `site` and `organization` is interchangeable -- same goes for
           is `site_uuid` and `organization_uuid`.
 
+    The organization is memoized on the request object because it's needed by every view `get_queryset` and by
+    every `*FieldWithPermission` field of the serialized instances.
+
     :raise whatever exceptions get_current_organization().
 
     :return Organization.
     """
+    # `vars()` instead of `getattr()` which delegates to the wrapped `HttpRequest` in DRF requests.
+    organization = vars(request).get(REQUESTED_ORGANIZATION_ATTRIBUTE)
+    if organization is not None:
+        return organization
+
     organization_uuid = request.GET.get('organization_uuid')
     if organization_uuid:
         if is_active_staff_or_superuser(request.user):
-            return get_organization_by_uuid(organization_uuid)
+            organization = get_organization_by_uuid(organization_uuid)
         else:
             raise PermissionDenied('Not permitted to use the `organization_uuid` parameter.')
     else:
-        return get_current_organization(request)
+        organization = get_current_organization(request)
+
+    setattr(request, REQUESTED_ORGANIZATION_ATTRIBUTE, organization)
+    return organization
 
 
 def is_site_admin_user(request):
@@ -110,18 +220,43 @@ def is_site_admin_user(request):
         )
         return False
 
-    return is_active_admin_on_organization(user=request.user, organization=current_organization)
+    return is_organization_admin(request.user, current_organization)
 
 
 def is_course_with_public_access(course):
     """
-    Check PublicCourse access within the user's organization(s).
+    Check PublicCourse access within the course organization.
 
-    :param user: User model object.
     :param course: CourseOverview model object.
     :return: bool.
     """
-    return PublicCourse.objects.filter(course_id=course.id).exists()
+    return str(course.id) in get_public_course_ids(course.id.org)
+
+
+def get_public_course_ids(org):
+    """
+    Get the public course ids of an organization from the cache, or the database on cache misses.
+
+    The cache is invalidated by the `PublicCourse` post_save and post_delete signals.
+
+    :param org: The organization part of the course keys e.g. `edX` for `course-v1:edX+DemoX+Demo_Course`.
+    :return: frozenset of course id strings.
+    """
+    public_course_ids = public_courses_cache.get(org)
+    if public_course_ids is None:
+        public_course_ids = frozenset(
+            str(course_id)
+            for course_id in PublicCourse.objects.filter(course__org=org).values_list('course_id', flat=True)
+        )
+        public_courses_cache.set(org, public_course_ids)
+    return public_course_ids
+
+
+def invalidate_public_course_ids(org):
+    """
+    Remove the cached public course ids of an organization.
+    """
+    public_courses_cache.delete(org)
 
 
 class IsSiteAdminUser(BasePermission):
@@ -162,10 +297,27 @@ def user_has_access_to_course(user, course):
     """
     Main function to check if user has access.
 
+    The decision is memoized for the rest of the request because Open edX checks the same course
+    many times while rendering a single page.
+
     :param user: User to check access against.
     :param course: CourseDescriptorWithMixins or CourseOverview object to check access for.
     :return: bool: whether the user is granted access or no.
     """
+    request_cache = get_request_cache()
+    if request_cache is None:
+        return _user_has_access_to_course(user, course)
+
+    cache_key = ('user_has_access_to_course', user.pk, str(course.id))
+    if cache_key not in request_cache:
+        request_cache[cache_key] = _user_has_access_to_course(user, course)
+    return request_cache[cache_key]
+
+
+def _user_has_access_to_course(user, course):
+    """
+    Evaluate the Course Access Groups rules for `user_has_access_to_course` without memoization.
+    """
     if is_course_with_public_access(course=course):
         return True
 
@@ -176,16 +328,244 @@ def user_has_access_to_course(user, course):
     if is_active_staff_or_superuser(user):
         return True
 
-    if is_organization_staff(user, course):
+    if has_group_access(user, course):
         return True
 
-    user_groups = CourseAccessGroup.objects.filter(
-        pk__in=Membership.objects.filter(
-            user=user,
-        ).values('group_id'),
-    )
+    return is_organization_staff(user, course)
+
+
+def has_group_access(user, course):
+    """
+    Check whether the course is linked to the user's group.
+
+    :param user: Authenticated user to check access against.
+    :param course: CourseDescriptorWithMixins or CourseOverview object to check access for.
+    :return: bool.
+    """
+    membership_group = get_user_membership_group(user)
+    if membership_group is None:
+        return False
+
+    group_id, organization_id = membership_group
+    return get_organization_access_index(organization_id).has_course(group_id, str(course.id))
+
+
+def get_user_group_course_ids(user):
+    """
+    Get the course ids granted to the user via the Membership group.
+
+    :param user: Authenticated user.
+    :return: set of course id strings.
+    """
+    membership_group = get_user_membership_group(user)
+    if membership_group is None:
+        return set()
+
+    group_id, organization_id = membership_group
+    return get_organization_access_index(organization_id).get_group_course_ids(group_id)
+
+
+def get_user_membership_group(user):
+    """
+    Get the Membership group of the user from the cache, or the database on cache misses.
+
+    Users reference their group instead of caching its courses, so a `Membership` change only invalidates
+    the user entry while `GroupCourse` changes only invalidates the organization access index.
+
+    Most learners have no Membership, so that outcome is cached as well to deny group access without queries.
+    It's invalidated by the `Membership` post_save signal including the ones created by `create_from_rules`.
+
+    :param user: Authenticated user.
+    :return: tuple: (group id, organization id) or None.
+    """
+    membership_group = user_groups_cache.get(user.pk)
+    if membership_group is None:
+        membership_group = Membership.objects.filter(user=user).values_list(
+            'group_id',
+            'group__organization_id',
+        ).first() or USER_WITHOUT_MEMBERSHIP
+        user_groups_cache.set(user.pk, membership_group)
+
+    if membership_group == USER_WITHOUT_MEMBERSHIP:
+        return None
+    return membership_group
+
+
+def invalidate_user_group(user_id):
+    """
+    Remove the cached Membership group of the user.
+    """
+    user_groups_cache.delete(user_id)
+
+
+def user_has_access_to_courses(user, courses):
+    """
+    Bulk version of `user_has_access_to_course` for pages listing many courses.
+
+    Uses a constant number of queries regardless of the number of courses. With empty caches there's one query
+    for the user membership and one for the course organizations, plus one per distinct organization for each of
+    the public courses, the group courses index and the organization admin check. All of these results are cached.
+
+    :param user: User to check access against.
+    :param courses: Iterable of CourseDescriptorWithMixins or CourseOverview objects to check access for.
+    :return: dict: {course_id: bool} whether the user is granted access or no for each course.
+    """
+    course_ids = {str(course.id): course.id for course in courses}
+    request_cache = get_request_cache()
+
+    decisions = {}
+    if request_cache is not None:
+        for course_id_str, course_id in course_ids.items():
+            cache_key = ('user_has_access_to_course', user.pk, course_id_str)
+            if cache_key in request_cache:
+                decisions[course_id_str] = request_cache[cache_key]
+
+    pending_ids = [course_id for course_id_str, course_id in course_ids.items() if course_id_str not in decisions]
+    if pending_ids:
+        new_decisions = _user_has_access_to_courses(user, pending_ids)
+        decisions.update(new_decisions)
+        if request_cache is not None:
+            for course_id_str, has_access in new_decisions.items():
+                request_cache[('user_has_access_to_course', user.pk, course_id_str)] = has_access
+
+    return {course_id: decisions[course_id_str] for course_id_str, course_id in course_ids.items()}
+
+
+def _user_has_access_to_courses(user, course_ids):
+    """
+    Evaluate the Course Access Groups rules for `user_has_access_to_courses` without memoization.
+
+    :param user: User to check access against.
+    :param course_ids: List of CourseKey objects.
+    :return: dict: {course id string: bool}.
+    """
+    decisions = {str(course_id): False for course_id in course_ids}
+
+    if user.is_authenticated and is_active_staff_or_superuser(user):
+        return {course_id_str: True for course_id_str in decisions}
+
+    for org in {course_id.org for course_id in course_ids}:
+        for course_id_str in get_public_course_ids(org):
+            if course_id_str in decisions:
+                decisions[course_id_str] = True
+
+    if not user.is_authenticated:
+        # AnonymousUser cannot have Membership.
+        return decisions
+
+    membership_group = get_user_membership_group(user)
+    if membership_group:
+        group_id, organization_id = membership_group
+        pending_ids = [course_id_str for course_id_str, has_access in decisions.items() if not has_access]
+        for course_id_str in get_organization_access_index(organization_id).filter_courses(group_id, pending_ids):
+            decisions[course_id_str] = True
+
+    denied_ids = [course_id_str for course_id_str, has_access in decisions.items() if not has_access]
+    if denied_ids and user.is_active:
+        admin_statuses = {}  # Check each organization once, courses of a page usually share a single organization.
+        for course_id_str, organization in _get_organizations_by_courses(denied_ids).items():
+            if organization.pk not in admin_statuses:
+                admin_statuses[organization.pk] = is_organization_admin(user, organization)
+            decisions[course_id_str] = admin_statuses[organization.pk]
+
+    return decisions
+
+
+def _get_organizations_by_courses(course_id_strs):
+    """
+    Bulk version of `get_course_organization` which skips courses with zero or multiple organizations.
+
+    Uses the caches of `get_course_organization` and resolves all cache misses in a single query.
+
+    :param course_id_strs: List of course id strings.
+    :return: dict: {course id string: Organization}.
+    """
+    outcomes = course_organizations_cache.get_many(course_id_strs)
+
+    missing_ids = [course_id_str for course_id_str in course_id_strs if course_id_str not in outcomes]
+    if missing_ids:
+        resolved = {course_id_str: COURSE_WITHOUT_ORGANIZATION for course_id_str in missing_ids}
+        # Same as `get_organization_by_course`: only active links count, and many links to one organization are fine.
+        course_links = OrganizationCourse.objects.filter(
+            course_id__in=missing_ids,
+            active=True,
+        ).select_related('organization')
+        for course_link in course_links:
+            outcome = resolved[course_link.course_id]
+            if outcome == COURSE_WITHOUT_ORGANIZATION:
+                resolved[course_link.course_id] = course_link.organization
+            elif outcome != COURSE_WITH_MULTIPLE_ORGANIZATIONS and outcome.pk != course_link.organization_id:
+                log.warning(
+                    'Course Access Group: This module expects a one:one relationship between organizations and course. '
+                    'Raised by course (%s)', course_link.course_id
+                )
+                resolved[course_link.course_id] = COURSE_WITH_MULTIPLE_ORGANIZATIONS
+
+        course_organizations_cache.set_many(resolved)
+        outcomes.update(resolved)
+
+    return {
+        course_id_str: outcome
+        for course_id_str, outcome in outcomes.items()
+        if outcome not in (COURSE_WITHOUT_ORGANIZATION, COURSE_WITH_MULTIPLE_ORGANIZATIONS)
+    }
+
+
+def filter_courses_for_user(user, queryset):
+    """
+    Restrict a CourseOverview queryset to the courses the user has access to.
+
+    Applies the same rules of `user_has_access_to_course` in the database, which allows paginating
+    on permitted courses instead of fetching and discarding rows in Python. The `UserCourseAccess` table is
+    used when the `COURSE_ACCESS_GROUPS_MATERIALIZE_ACCESS` setting is enabled.
+
+    :param user: User to check access against.
+    :param queryset: CourseOverview queryset.
+    :return: CourseOverview queryset.
+    """
+    if not user.is_authenticated:
+        # AnonymousUser cannot have Membership.
+        return queryset.filter(public_course__isnull=False)
+
+    if is_active_staff_or_superuser(user):
+        return queryset
+
+    if is_access_materialization_enabled():
+        # A single indexed lookup on the materialized public and group courses.
+        access_filter = Q(
+            id__in=UserCourseAccess.objects.filter(Q(user=user) | Q(user__isnull=True)).values('course_id'),
+        )
+    else:
+        # Using `id__in` for group courses to avoid duplicate rows for courses with multiple groups.
+        access_filter = Q(public_course__isnull=False) | Q(
+            id__in=GroupCourse.objects.filter(group__membership__user=user).values('course_id'),
+        )
+
+    admin_organization = _get_admin_organization(user)
+    if admin_organization:
+        access_filter |= Q(
+            id__in=OrganizationCourse.objects.filter(organization=admin_organization, active=True).values('course_id'),
+        )
+
+    return queryset.filter(access_filter)
+
+
+def _get_admin_organization(user):
+    """
+    Get the organization in which the user is an active admin.
+
+    :param user: User object.
+    :return: Organization or None.
+    """
+    if not user.is_active:
+        return None
+
+    try:
+        organization = get_organization_for_user(user)
+    except (Organization.DoesNotExist, Organization.MultipleObjectsReturned):
+        return None
+
+    if is_organization_admin(user, organization):
+        return organization
 
-    return GroupCourse.objects.filter(
-        course_id=course.id,
-        group__in=user_groups,
-    ).exists()
+    return None
@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+"""
+Compiled in-memory index of the MembershipRule of each organization.
+"""
+
+from django.db.models import Q
+
+from .cache import TwoTierCache
+from .models import MembershipRule
+from .validators import WILDCARD_DOMAIN_PREFIX
+
+RULE_KEY = ''  # Domain labels are never empty, so it can't clash with a label in the trie nodes.
+
+membership_rules_cache = TwoTierCache('membership_rules')
+
+
+class MembershipRuleIndex:
+    """
+    Email domain to group index of an organization.
+
+    Exact domains are kept in a dict. Subdomain rules such as `*.university.edu` are kept in a trie of
+    reversed domain labels i.e. `edu` -> `university` so matching is proportional to the number of labels
+    and not to the number of rules.
+
+    Exact rules take precedence over subdomain rules, and the longest matching subdomain rule wins.
+    """
+
+    def __init__(self, exact_rules, wildcard_trie):
+        self.exact_rules = exact_rules
+        self.wildcard_trie = wildcard_trie
+
+    @classmethod
+    def build(cls, organization_id):
+        """
+        Compile the rules of an organization with a single query.
+
+        :param organization_id: Organization primary key.
+        :return: MembershipRuleIndex.
+        """
+        rules = MembershipRule.objects.filter(group__organization_id=organization_id).order_by('id')
+        return cls.from_rules(rules.values_list('domain', 'group_id'))
+
+    @classmethod
+    def from_rules(cls, rules):
+        """
+        Compile rules which aren't necessarily stored e.g. to simulate proposed rules.
+
+        Rules with duplicate domains are resolved to the first one.
+
+        :param rules: Iterable of (domain, group id) tuples.
+        :return: MembershipRuleIndex.
+        """
+        exact_rules = {}
+        wildcard_trie = {}
+        for domain, group_id in rules:
+            domain = domain.lower()
+            if domain.startswith(WILDCARD_DOMAIN_PREFIX):
+                node = wildcard_trie
+                for label in reversed(domain[len(WILDCARD_DOMAIN_PREFIX):].split('.')):
+                    node = node.setdefault(label, {})
+                node.setdefault(RULE_KEY, group_id)
+            else:
+                exact_rules.setdefault(domain, group_id)
+        return cls(exact_rules, wildcard_trie)
+
+    def has_rules(self):
+        """
+        Check whether the organization has any rules to match.
+        """
+        return bool(self.exact_rules or self.wildcard_trie)
+
+    def match(self, email_domain):
+        """
+        Find the group of an email domain.
+
+        :param email_domain: The domain part of an email address e.g. `cs.university.edu`.
+        :return: CourseAccessGroup primary key or None.
+        """
+        email_domain = email_domain.lower()
+        group_id = self.exact_rules.get(email_domain)
+        if group_id is not None:
+            return group_id
+
+        labels = email_domain.split('.')
+        node = self.wildcard_trie
+        # The first label is skipped, `*.university.edu` matches subdomains and not `university.edu` itself.
+        for label in reversed(labels[1:]):
+            node = node.get(label)
+            if node is None:
+                break
+            group_id = node.get(RULE_KEY, group_id)
+        return group_id
+
+    def match_email(self, email):
+        """
+        Find the group of an email address.
+
+        :param email: Email address e.g. `learner@cs.university.edu`.
+        :return: CourseAccessGroup primary key or None.
+        """
+        _, _, email_domain = email.rpartition('@')
+        return self.match(email_domain)
+
+
+def get_membership_rule_index(organization_id):
+    """
+    Get the compiled rules of an organization from the cache, or build them on cache misses.
+
+    :param organization_id: Organization primary key.
+    :return: MembershipRuleIndex.
+    """
+    index = membership_rules_cache.get(organization_id)
+    if index is None:
+        index = MembershipRuleIndex.build(organization_id)
+        membership_rules_cache.set(organization_id, index)
+    return index
+
+
+def invalidate_membership_rule_index(organization_id):
+    """
+    Remove the compiled rules of an organization.
+    """
+    membership_rules_cache.delete(organization_id)
+
+
+def get_email_domain_filter(domain):
+    """
+    Build a users filter matching the emails of a MembershipRule domain.
+
+    :param domain: Rule domain e.g. `example.com` or `*.university.edu`.
+    :return: Q object.
+    """
+    if domain.startswith(WILDCARD_DOMAIN_PREFIX):
+        return Q(email__iendswith=domain[len(WILDCARD_DOMAIN_PREFIX) - 1:])  # Keeps the dot e.g. `.university.edu`
+    return Q(email__iendswith='@{}'.format(domain))
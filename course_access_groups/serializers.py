@@ -12,6 +12,7 @@ from tahoe_sites.api import get_users_of_organization
 from .models import CourseAccessGroup, GroupCourse, Membership, MembershipRule, PublicCourse
 from .openedx_modules import CourseOverview
 from .permissions import get_requested_organization
+from .validators import validate_domain
 
 
 class CourseKeyFieldWithPermission(serializers.RelatedField):
@@ -48,16 +49,46 @@ class CourseKeyFieldWithPermission(serializers.RelatedField):
         """
         Course API representation.
         """
-        try:
-            course = self.get_queryset().get(id=course_key)
-        except CourseOverview.DoesNotExist:
-            raise ValidationError('Something went wrong with your request.')
+        course = self.get_courses_map().get(course_key)
+        if course is None:
+            # The course isn't in the serialized instances e.g. when the serializer context is reused.
+            course = self.get_queryset().filter(id=course_key).first()
+            if course is None:
+                raise ValidationError('Something went wrong with your request.')
+            self.get_courses_map()[course_key] = course
 
         return {
             'id': str(course.id),
             'name': course.display_name_with_default,
         }
 
+    def get_courses_map(self):
+        """
+        Get the organization courses of all the serialized instances from the serializer context.
+
+        The map is filled with a single query on the first call, instead of a query per serialized instance.
+
+        :return: dict: {course_key: CourseOverview}.
+        """
+        context_key = 'course_key_field_courses'
+        courses_map = self.context.get(context_key)
+        if courses_map is None:
+            course_keys = [self.get_attribute(instance) for instance in self.get_serialized_instances()]
+            courses_map = {course.id: course for course in self.get_queryset().filter(id__in=course_keys)}
+            self.context[context_key] = courses_map
+        return courses_map
+
+    def get_serialized_instances(self):
+        """
+        Get the instances of the serializer owning this field, for both single and list serializations.
+        """
+        root = self.root
+        if self.parent is root and root.instance is not None:
+            return [root.instance]
+        if isinstance(root, serializers.ListSerializer) and self.parent is root.child and root.instance is not None:
+            return list(root.instance)
+        return []
+
 
 class UserFieldWithPermission(serializers.RelatedField):
     """
@@ -142,6 +173,23 @@ class MembershipRuleSerializer(serializers.ModelSerializer):
         ]
 
 
+class ProposedMembershipRuleSerializer(serializers.Serializer):
+    domain = serializers.CharField(max_length=255, validators=[validate_domain])
+    group = CourseAccessGroupFieldWithPermission()
+
+
+class MembershipRuleSimulationSerializer(serializers.Serializer):
+    """
+    Proposed rule set to evaluate against the organization users without saving it.
+    """
+
+    rules = ProposedMembershipRuleSerializer(many=True)
+    include_users = serializers.BooleanField(
+        default=False,
+        help_text='Stream the affected users as NDJSON instead of returning the counts.',
+    )
+
+
 class PublicCourseSerializer(serializers.ModelSerializer):
     course = CourseKeyFieldWithPermission(source='course_id')
 
@@ -207,7 +255,8 @@ class CourseOverviewSerializer(serializers.ModelSerializer):
 
     def get_public_status(self, course):
         try:
-            public_course = PublicCourse.objects.get(course_id=course.id)
+            # Reverse relation instead of a query so `select_related('public_course')` can be used
+            public_course = course.public_course
             return {
                 'id': public_course.id,
                 'is_public': True,
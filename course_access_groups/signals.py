@@ -5,9 +5,24 @@ Signals and receivers for Course Access Groups.
 
 import logging
 
-from organizations.models import Organization
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+from organizations.models import Organization, OrganizationCourse
+from tahoe_sites.models import UserOrganizationMapping
 
-from .models import Membership
+from . import materialized_access
+from .access_index import invalidate_organization_access_index
+from .cache import invalidate_on_commit, reset_request_cache
+from .feature_flag import is_access_materialization_enabled, is_deferred_membership_rules_enabled
+from .membership_rules import defer_membership_rules, schedule_membership_rules_reevaluation
+from .models import CourseAccessGroup, GroupCourse, Membership, MembershipRule, PublicCourse
+from .permissions import (
+    invalidate_course_organization,
+    invalidate_organization_admin,
+    invalidate_public_course_ids,
+    invalidate_user_group,
+)
+from .rule_index import invalidate_membership_rule_index
 
 log = logging.getLogger(__name__)
 
@@ -20,6 +35,11 @@ def on_learner_account_activated(sender, user, **kwargs):
     :param user: The activated learner.
     :param kwargs: Extra keyword args.
     """
+    if is_deferred_membership_rules_enabled():
+        # Inactive users and users without an organization yet are skipped by the background worker.
+        defer_membership_rules(user.pk)
+        return
+
     try:
         Membership.create_from_rules(user)
     except Organization.DoesNotExist:
@@ -47,7 +67,10 @@ def on_learner_register(sender, user, **kwargs):
             # Unlike the `USER_ACCOUNT_ACTIVATED` signal, the `REGISTER_USER` signal gets sent for both active and
             # inactive users. However, `Membership.create_from_rules` would raise an exception when called with an
             # inactive user, hence this check.
-            Membership.create_from_rules(user)
+            if is_deferred_membership_rules_enabled():
+                defer_membership_rules(user.pk)
+            else:
+                Membership.create_from_rules(user)
         else:
             log.info(
                 'Received REGISTER_USER signal for inactive user %s pk=%s, is_active=%s, sender=%s '
@@ -58,3 +81,217 @@ def on_learner_register(sender, user, **kwargs):
         log.exception('Error receiving REGISTER_USER signal for user %s pk=%s, is_active=%s, sender=%s',
                       user.email, user.pk, user.is_active, sender)
         raise
+
+
+@receiver(post_save, sender=CourseAccessGroup)
+@receiver(post_delete, sender=CourseAccessGroup)
+@receiver(post_save, sender=GroupCourse)
+@receiver(post_delete, sender=GroupCourse)
+@receiver(post_save, sender=Membership)
+@receiver(post_delete, sender=Membership)
+@receiver(post_save, sender=PublicCourse)
+@receiver(post_delete, sender=PublicCourse)
+def on_access_rules_changed(sender, **kwargs):
+    """
+    Discard the access decisions memoized in the current request once the access rules are modified.
+    """
+    reset_request_cache()
+
+
+@receiver(pre_save, sender=GroupCourse)
+@receiver(pre_save, sender=Membership)
+@receiver(pre_save, sender=PublicCourse)
+def on_access_rule_pre_save(sender, instance, **kwargs):
+    """
+    Remember the stored row of edited access rules to revoke the old access after saving.
+    """
+    instance.previous_instance = None
+    if instance.pk:
+        instance.previous_instance = sender.objects.filter(pk=instance.pk).first()
+
+
+def _get_changed_previous_instance(instance, fields, signal):
+    """
+    Get the stored row remembered by `on_access_rule_pre_save` if any of the fields is changed.
+
+    The row is only used for post_save, it's outdated when an instance saved earlier is deleted.
+
+    :return: The model object or None.
+    """
+    if signal is not post_save:
+        return None
+
+    previous_instance = getattr(instance, 'previous_instance', None)
+    if previous_instance and any(getattr(previous_instance, field) != getattr(instance, field) for field in fields):
+        return previous_instance
+    return None
+
+
+@receiver(post_save, sender=PublicCourse)
+@receiver(post_delete, sender=PublicCourse)
+def on_public_course_changed(sender, instance, **kwargs):
+    """
+    Invalidate the cached public courses of the course organization.
+    """
+    invalidate_on_commit(invalidate_public_course_ids, instance.course_id.org)
+    previous_instance = _get_changed_previous_instance(instance, ['course_id'], kwargs['signal'])
+    if previous_instance:
+        invalidate_on_commit(invalidate_public_course_ids, previous_instance.course_id.org)
+
+
+@receiver(post_save, sender=OrganizationCourse)
+@receiver(post_delete, sender=OrganizationCourse)
+def on_organization_course_changed(sender, instance, **kwargs):
+    """
+    Invalidate the cached organization of the course.
+    """
+    invalidate_on_commit(invalidate_course_organization, instance.course_id)
+    reset_request_cache()
+
+
+@receiver(post_save, sender=UserOrganizationMapping)
+@receiver(post_delete, sender=UserOrganizationMapping)
+def on_user_organization_mapping_changed(sender, instance, **kwargs):
+    """
+    Invalidate the cached admin status and decisions when a user joins, leaves or gets promoted in an organization.
+    """
+    invalidate_on_commit(invalidate_organization_admin, instance.user_id, instance.organization_id)
+    reset_request_cache()
+
+
+@receiver(post_delete, sender=CourseAccessGroup)
+def on_group_deleted(sender, instance, **kwargs):
+    """
+    Invalidate the access index of the group organization.
+
+    Memberships of the deleted group are invalidated by their own (cascade) post_delete signals.
+    """
+    invalidate_on_commit(invalidate_organization_access_index, instance.organization_id)
+
+
+@receiver(post_save, sender=GroupCourse)
+@receiver(post_delete, sender=GroupCourse)
+def on_group_course_changed(sender, instance, **kwargs):
+    """
+    Invalidate the access index of the group organization.
+    """
+    group_ids = {instance.group_id}
+    previous_instance = _get_changed_previous_instance(instance, ['group_id'], kwargs['signal'])
+    if previous_instance:
+        group_ids.add(previous_instance.group_id)
+
+    for group_id in group_ids:
+        organization_id = _get_group_organization_id(group_id)
+        if organization_id:
+            invalidate_on_commit(invalidate_organization_access_index, organization_id)
+
+
+@receiver(pre_save, sender=MembershipRule)
+def on_membership_rule_pre_save(sender, instance, **kwargs):
+    """
+    Remember the stored domain of edited rules to re-evaluate the users of both the old and the new domains.
+    """
+    instance.previous_domain = None
+    if instance.pk:
+        stored_rules = MembershipRule.objects.filter(pk=instance.pk)
+        instance.previous_domain = stored_rules.values_list('domain', flat=True).first()
+
+
+@receiver(post_save, sender=MembershipRule)
+@receiver(post_delete, sender=MembershipRule)
+def on_membership_rule_changed(sender, instance, **kwargs):
+    """
+    Invalidate the compiled rules of the group organization and re-evaluate the affected automatic memberships.
+    """
+    organization_id = _get_group_organization_id(instance.group_id)
+    if organization_id:
+        invalidate_on_commit(invalidate_membership_rule_index, organization_id)
+        domains = {instance.domain}
+        if kwargs['signal'] is post_save and getattr(instance, 'previous_domain', None):
+            # The pre_save domain of an edited rule, it's outdated when the rule is deleted later.
+            domains.add(instance.previous_domain)
+        schedule_membership_rules_reevaluation(organization_id, domains)
+
+
+def _get_group_organization_id(group_id):
+    """
+    Get the organization id of a group.
+
+    Querying the organization id because `instance.group` may be already deleted in case of cascade deletes.
+    """
+    return CourseAccessGroup.objects.filter(pk=group_id).values_list('organization_id', flat=True).first()
+
+
+@receiver(post_save, sender=Membership)
+@receiver(post_delete, sender=Membership)
+def on_membership_changed(sender, instance, **kwargs):
+    """
+    Invalidate the cached group of the user.
+    """
+    invalidate_on_commit(invalidate_user_group, instance.user_id)
+    previous_instance = _get_changed_previous_instance(instance, ['user_id'], kwargs['signal'])
+    if previous_instance:
+        invalidate_on_commit(invalidate_user_group, previous_instance.user_id)
+
+
+@receiver(post_save, sender=Membership)
+def on_membership_saved_materialize(sender, instance, **kwargs):
+    """
+    Maintain the `UserCourseAccess` table, if enabled.
+    """
+    if is_access_materialization_enabled():
+        previous_instance = _get_changed_previous_instance(instance, ['user_id'], kwargs['signal'])
+        if previous_instance:
+            materialized_access.dematerialize_membership(previous_instance)
+        materialized_access.materialize_membership(instance)
+
+
+@receiver(post_delete, sender=Membership)
+def on_membership_deleted_materialize(sender, instance, **kwargs):
+    """
+    Maintain the `UserCourseAccess` table, if enabled.
+    """
+    if is_access_materialization_enabled():
+        materialized_access.dematerialize_membership(instance)
+
+
+@receiver(post_save, sender=GroupCourse)
+def on_group_course_saved_materialize(sender, instance, **kwargs):
+    """
+    Maintain the `UserCourseAccess` table, if enabled.
+    """
+    if is_access_materialization_enabled():
+        previous_instance = _get_changed_previous_instance(instance, ['course_id', 'group_id'], kwargs['signal'])
+        if previous_instance:
+            materialized_access.dematerialize_group_course(previous_instance)
+        materialized_access.materialize_group_course(instance)
+
+
+@receiver(post_delete, sender=GroupCourse)
+def on_group_course_deleted_materialize(sender, instance, **kwargs):
+    """
+    Maintain the `UserCourseAccess` table, if enabled.
+    """
+    if is_access_materialization_enabled():
+        materialized_access.dematerialize_group_course(instance)
+
+
+@receiver(post_save, sender=PublicCourse)
+def on_public_course_saved_materialize(sender, instance, **kwargs):
+    """
+    Maintain the `UserCourseAccess` table, if enabled.
+    """
+    if is_access_materialization_enabled():
+        previous_instance = _get_changed_previous_instance(instance, ['course_id'], kwargs['signal'])
+        if previous_instance:
+            materialized_access.dematerialize_public_course(previous_instance)
+        materialized_access.materialize_public_course(instance)
+
+
+@receiver(post_delete, sender=PublicCourse)
+def on_public_course_deleted_materialize(sender, instance, **kwargs):
+    """
+    Maintain the `UserCourseAccess` table, if enabled.
+    """
+    if is_access_materialization_enabled():
+        materialized_access.dematerialize_public_course(instance)
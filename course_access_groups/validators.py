@@ -8,14 +8,22 @@ from django.core.exceptions import ValidationError
 from django.core.validators import validate_email
 from django.utils.translation import ugettext as _
 
+WILDCARD_DOMAIN_PREFIX = '*.'
+
 
 def validate_domain(value):
     """
     Validate a domain name.
 
+    Subdomain wildcards are allowed as a prefix e.g. `*.example.com` to match `cs.example.com`.
+
     :param value: The domain name.
     :raise ValidationError: When the domain is not valid.
     """
+    domain = value
+    if domain.startswith(WILDCARD_DOMAIN_PREFIX):
+        domain = domain[len(WILDCARD_DOMAIN_PREFIX):]
+
     domain_regex = validate_email.domain_regex
-    if not domain_regex.match(value):
+    if not domain_regex.match(domain):
         raise ValidationError(_('The domain name is not valid: {domain}').format(domain=value))
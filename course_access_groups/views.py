@@ -4,24 +4,33 @@ API Endpoints for Course Access Groups.
 """
 
 
+import json
+
 from django.contrib.auth import get_user_model
+from django.http import StreamingHttpResponse
 from django_filters.rest_framework import DjangoFilterBackend
 from opaque_keys.edx.keys import CourseKey
 from organizations.models import OrganizationCourse
 from rest_framework import viewsets
+from rest_framework.decorators import action
 from rest_framework.filters import SearchFilter
 from rest_framework.pagination import LimitOffsetPagination
+from rest_framework.response import Response
 from tahoe_sites.api import get_users_of_organization
 
 from .filters import CourseOverviewFilter, UserFilter
+from .membership_rules import iterate_simulated_changes, simulate_membership_rules
 from .models import CourseAccessGroup, GroupCourse, Membership, MembershipRule, PublicCourse
 from .openedx_modules import CourseOverview
+from .pagination import SelectablePagination
 from .permissions import CommonAuthMixin, get_requested_organization
+from .rule_index import MembershipRuleIndex
 from .serializers import (
     CourseAccessGroupSerializer,
     CourseOverviewSerializer,
     GroupCourseSerializer,
     MembershipRuleSerializer,
+    MembershipRuleSimulationSerializer,
     MembershipSerializer,
     PublicCourseSerializer,
     UserSerializer
@@ -80,12 +89,16 @@ class CourseViewSet(CommonAuthMixin, viewsets.ReadOnlyModelViewSet):
                 organization=organization,
                 active=True,
             ).values('course_id'),
+        ).select_related(
+            'public_course',  # Used by `CourseOverviewSerializer.get_public_status`
+        ).prefetch_related(
+            'group_courses__group',  # Used by the `group_links` field
         )
 
 
 class MembershipViewSet(CommonAuthMixin, viewsets.ModelViewSet):
     model = Membership
-    pagination_class = LimitOffsetPagination
+    pagination_class = SelectablePagination
     serializer_class = MembershipSerializer
 
     def get_queryset(self):
@@ -106,6 +119,29 @@ class MembershipRuleViewSet(CommonAuthMixin, viewsets.ModelViewSet):
             group__in=CourseAccessGroup.objects.filter(organization=organization),
         )
 
+    @action(detail=False, methods=['post'])
+    def simulate(self, request):
+        """
+        Evaluate a proposed rule set against the organization users without saving anything.
+
+        POST /membership-rules/simulate/
+        """
+        serializer = MembershipRuleSimulationSerializer(data=request.data, context=self.get_serializer_context())
+        serializer.is_valid(raise_exception=True)
+        organization = get_requested_organization(request)
+        rule_index = MembershipRuleIndex.from_rules(
+            (rule['domain'], rule['group'].pk) for rule in serializer.validated_data['rules']
+        )
+
+        if serializer.validated_data['include_users']:
+            changes = iterate_simulated_changes(organization, rule_index)
+            return StreamingHttpResponse(
+                ('{}\n'.format(json.dumps(change)) for change in changes),
+                content_type='application/x-ndjson',
+            )
+
+        return Response(simulate_membership_rules(organization, rule_index))
+
 
 class PublicCourseViewSet(CommonAuthMixin, viewsets.ModelViewSet):
     """
@@ -134,7 +170,7 @@ class UserViewSet(CommonAuthMixin, viewsets.ReadOnlyModelViewSet):
     """
 
     model = get_user_model()
-    pagination_class = LimitOffsetPagination
+    pagination_class = SelectablePagination
     serializer_class = UserSerializer
     filterset_class = UserFilter
     filter_backends = [DjangoFilterBackend, SearchFilter]
@@ -150,11 +186,11 @@ class UserViewSet(CommonAuthMixin, viewsets.ReadOnlyModelViewSet):
 
 class GroupCourseViewSet(CommonAuthMixin, viewsets.ModelViewSet):
     model = GroupCourse
-    pagination_class = LimitOffsetPagination
+    pagination_class = SelectablePagination
     serializer_class = GroupCourseSerializer
 
     def get_queryset(self):
         organization = get_requested_organization(self.request)
         return self.model.objects.filter(
             group__in=CourseAccessGroup.objects.filter(organization=organization),
-        )
+        ).select_related('group')
@@ -98,10 +98,11 @@ class CourseOverviewFactory(DjangoModelFactory):
         django_get_or_create = ['id']
 
     org = factory.Sequence('org{}'.format)
+    number = factory.Sequence('toy{}'.format)
 
     @factory.lazy_attribute
     def id(self):
-        return CourseKey.from_string('course-v1:{}+toy+2012_Fall'.format(self.org))
+        return CourseKey.from_string('course-v1:{}+{}+2012_Fall'.format(self.org, self.number))
 
     @factory.lazy_attribute
     def display_name(self):
@@ -4,10 +4,26 @@ CAG unit test configuration and fixtures.
 
 
 import pytest
+from django.core.cache import cache
 
+from course_access_groups.cache import clear_local_caches, clear_request_cache
 from test_utils.factories import UserFactory
 
 
+@pytest.fixture(autouse=True)
+def clear_caches():
+    """
+    Ensure cached access data don't leak between tests.
+    """
+    clear_request_cache()
+    clear_local_caches()
+    cache.clear()
+    yield
+    clear_request_cache()
+    clear_local_caches()
+    cache.clear()
+
+
 @pytest.mark.django_db
 @pytest.fixture(scope='function')
 def standard_test_users():
@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for the compiled group courses index.
+"""
+
+
+import pytest
+from mock import patch
+
+from course_access_groups.access_index import (
+    OrganizationAccessIndex,
+    get_organization_access_index,
+    index_versions_cache,
+    invalidate_organization_access_index,
+)
+from course_access_groups.cache import LRUCache
+from test_utils.factories import (
+    CourseAccessGroupFactory,
+    CourseOverviewFactory,
+    GroupCourseFactory,
+    OrganizationFactory,
+)
+
+
+@pytest.mark.django_db
+class TestOrganizationAccessIndex:
+    """
+    Tests for the OrganizationAccessIndex bitsets.
+    """
+
+    @pytest.fixture(autouse=True)
+    def setup(self):
+        self.organization = OrganizationFactory.create()
+        self.group = CourseAccessGroupFactory.create(organization=self.organization)
+        self.other_group = CourseAccessGroupFactory.create(organization=self.organization)
+        self.courses = CourseOverviewFactory.create_batch(3)
+        GroupCourseFactory.create(group=self.group, course=self.courses[0])
+        GroupCourseFactory.create(group=self.group, course=self.courses[2])
+        GroupCourseFactory.create(group=self.other_group, course=self.courses[1])
+
+    def test_build_with_a_single_query(self, django_assert_num_queries):
+        with django_assert_num_queries(1):
+            index = OrganizationAccessIndex.build(self.organization.id, version=1)
+        assert index.version == 1
+        assert len(index.course_positions) == 3, 'Each course should get a position'
+
+    def test_has_course(self):
+        index = OrganizationAccessIndex.build(self.organization.id, version=1)
+        assert index.has_course(self.group.id, str(self.courses[0].id))
+        assert not index.has_course(self.group.id, str(self.courses[1].id)), 'Other group course'
+        assert not index.has_course(self.group.id, 'course-v1:Unknown+Course+Run'), 'Course not in the index'
+        assert not index.has_course(0, str(self.courses[0].id)), 'Group not in the index'
+
+    def test_filter_courses(self):
+        index = OrganizationAccessIndex.build(self.organization.id, version=1)
+        course_ids = [str(course.id) for course in self.courses] + ['course-v1:Unknown+Course+Run']
+        assert index.filter_courses(self.group.id, course_ids) == {str(self.courses[0].id), str(self.courses[2].id)}
+        assert index.filter_courses(self.other_group.id, course_ids) == {str(self.courses[1].id)}
+        assert index.filter_courses(self.group.id, []) == set()
+
+    def test_get_group_course_ids(self):
+        index = OrganizationAccessIndex.build(self.organization.id, version=1)
+        assert index.get_group_course_ids(self.group.id) == {str(self.courses[0].id), str(self.courses[2].id)}
+        assert index.get_group_course_ids(0) == set()
+
+    def test_other_organizations_excluded(self):
+        GroupCourseFactory.create(course=self.courses[1])
+        index = OrganizationAccessIndex.build(self.organization.id, version=1)
+        assert not index.has_course(self.group.id, str(self.courses[1].id))
+        assert len(index.group_bitsets) == 2, 'Only the organization groups should be compiled'
+
+
+@pytest.mark.django_db
+class TestGetOrganizationAccessIndex:
+    """
+    Tests for the cached organization index and its versioning.
+    """
+
+    @pytest.fixture(autouse=True)
+    def setup(self):
+        self.group = CourseAccessGroupFactory.create()
+        self.organization_id = self.group.organization_id
+        self.course = CourseOverviewFactory.create()
+
+    def test_cached_index(self, django_assert_num_queries):
+        index = get_organization_access_index(self.organization_id)
+        with django_assert_num_queries(0):
+            assert get_organization_access_index(self.organization_id) is index
+
+    def test_rebuilt_on_version_change(self):
+        index = get_organization_access_index(self.organization_id)
+        GroupCourseFactory.create(group=self.group, course=self.course)  # Bumps the version via signals
+        new_index = get_organization_access_index(self.organization_id)
+        assert new_index.version != index.version
+        assert new_index.has_course(self.group.id, str(self.course.id))
+
+    def test_rebuilt_on_other_process_changes(self):
+        """
+        Other processes only share the version, their local index should be rebuilt on the next access.
+        """
+        index = get_organization_access_index(self.organization_id)
+        with patch('course_access_groups.access_index._indexes.delete'):
+            invalidate_organization_access_index(self.organization_id)
+        index_versions_cache.local_cache.clear()  # Simulate the expiry of the local version
+        assert get_organization_access_index(self.organization_id) is not index
+
+    def test_memory_bound(self):
+        indexes = LRUCache(maxsize=2, timeout=60)
+        with patch('course_access_groups.access_index._indexes', indexes):
+            get_organization_access_index(self.organization_id)
+            for group in CourseAccessGroupFactory.create_batch(2):
+                get_organization_access_index(group.organization_id)
+            assert indexes.get(self.organization_id) is None, 'Least recently used index should be evicted'
+            assert len(indexes._data) == 2
@@ -8,6 +8,9 @@ import json
 
 import pytest
 from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from mock import patch
 from openedx.core.djangoapps.content.course_overviews.models import CourseOverview
 from organizations.models import Organization, OrganizationCourse
 from rest_framework.status import (
@@ -164,6 +167,33 @@ class TestMembershipViewSet(ViewSetTestBase):
         assert response.status_code == HTTP_200_OK, response.content
         assert len(results) == expected_count
 
+    def test_list_resolves_organization_once(self, client):
+        """
+        The requested organization is resolved once for the view and all the nested fields.
+        """
+        MembershipFactory.create_batch(3, group__organization=self.my_org)
+        with patch('course_access_groups.permissions.get_current_organization',
+                   return_value=self.my_org) as mock_get_current_organization:
+            response = client.get(self.url)
+        assert response.status_code == HTTP_200_OK, response.content
+        assert len(response.json()['results']) == 3
+        # Once by the `IsSiteAdminUser` permission check and once by `get_requested_organization`
+        assert mock_get_current_organization.call_count == 2
+
+    def test_list_memberships_cursor_pagination(self, client):
+        memberships = MembershipFactory.create_batch(3, group__organization=self.my_org)
+        MembershipFactory.create(group__organization=self.other_org)
+        response = client.get(self.url, {'pagination': 'cursor', 'limit': 2})
+        assert response.status_code == HTTP_200_OK, response.content
+        first_page = response.json()
+        response = client.get(first_page['next'])
+        assert response.status_code == HTTP_200_OK, response.content
+        second_page = response.json()
+
+        assert [m['id'] for m in first_page['results'] + second_page['results']] == [m.id for m in memberships]
+        assert second_page['next'] is None
+        assert 'count' not in first_page
+
     @pytest.mark.parametrize('group_org, status_code, skip_response_check', [
         ['my_org', HTTP_200_OK, False],
         ['other_org', HTTP_404_NOT_FOUND, True],
@@ -261,6 +291,85 @@ class TestUserViewSet(ViewSetTestBase):
         assert response.status_code == HTTP_200_OK, response.content
         assert len(results) == expected_count
 
+    def test_list_users_cursor_pagination(self, client):
+        """
+        Ensure all users can be synced by following the cursor `next` links.
+        """
+        users = UserFactory.create_batch(5)
+        UserOrganizationMappingFactory.create_for(self.my_org, users=users)
+
+        user_ids = []
+        url = '{}?pagination=cursor&limit=2'.format(self.url)
+        while url:
+            response = client.get(url)
+            assert response.status_code == HTTP_200_OK, response.content
+            page = response.json()
+            assert 'count' not in page, 'Cursor pagination should skip the COUNT query'
+            assert len(page['results']) <= 2
+            user_ids.extend(user['id'] for user in page['results'])
+            url = page['next']
+
+        assert user_ids == sorted(user.id for user in users), 'Should be ordered by id without duplicates'
+
+    def test_list_users_has_more_pagination(self, client):
+        """
+        Ensure the `has_more` pagination fetches the pages without counting the users.
+        """
+        users = UserFactory.create_batch(3)
+        UserOrganizationMappingFactory.create_for(self.my_org, users=users)
+
+        with CaptureQueriesContext(connection) as queries:
+            response = client.get(self.url, {'pagination': 'has_more', 'limit': 2})
+        assert response.status_code == HTTP_200_OK, response.content
+        first_page = response.json()
+        assert 'count' not in first_page
+        assert first_page['has_more']
+        assert not any('COUNT(' in query['sql'].upper() for query in queries.captured_queries)
+
+        response = client.get(first_page['next'])
+        assert response.status_code == HTTP_200_OK, response.content
+        second_page = response.json()
+        assert not second_page['has_more']
+        assert second_page['next'] is None
+        assert [user['id'] for user in first_page['results'] + second_page['results']] == [user.id for user in users]
+
+    def test_list_users_estimated_count(self, client):
+        """
+        Ensure the `estimate` pagination reuses the cached count of the same filters.
+        """
+        users = UserFactory.create_batch(3)
+        UserOrganizationMappingFactory.create_for(self.my_org, users=users)
+        response = client.get(self.url, {'pagination': 'estimate', 'limit': 1})
+        assert response.status_code == HTTP_200_OK, response.content
+        assert response.json()['count'] == 3
+
+        new_users = UserFactory.create_batch(2)
+        UserOrganizationMappingFactory.create_for(self.my_org, users=new_users)
+        response = client.get(self.url, {'pagination': 'estimate', 'limit': 1})
+        page = response.json()
+        assert page['count'] == 3, 'Should use the cached count'
+        assert page['has_more']
+
+        response = client.get(self.url, {'pagination': 'estimate', 'limit': 1, 'offset': 4})
+        page = response.json()
+        assert page['count'] == 5, 'Should not be lower than the fetched users'
+        assert not page['has_more']
+
+        response = client.get(self.url, {'pagination': 'estimate', 'email_exact': new_users[0].email})
+        assert response.json()['count'] == 1, 'Should count each filter separately'
+
+    def test_list_users_default_pagination(self, client):
+        """
+        Ensure clients without the `pagination` parameter keep getting the limit and offset pagination.
+        """
+        users = UserFactory.create_batch(3)
+        UserOrganizationMappingFactory.create_for(self.my_org, users=users)
+        response = client.get(self.url, {'limit': 2, 'offset': 2})
+        assert response.status_code == HTTP_200_OK, response.content
+        page = response.json()
+        assert page['count'] == 3
+        assert len(page['results']) == 1
+
     @pytest.mark.parametrize('org_name, status_code, skip_response_check', [
         ['my_org', HTTP_200_OK, False],
         ['other_org', HTTP_404_NOT_FOUND, True],
@@ -379,6 +488,27 @@ class TestCourseViewSet(ViewSetTestBase):
         assert response.status_code == HTTP_200_OK, response.content
         assert len(results) == expected_count
 
+    def test_list_queries_independent_of_page_size(self, client, django_assert_max_num_queries):
+        """
+        Ensure the public status and group links don't add queries per course.
+        """
+        def create_courses(count):
+            courses = CourseOverviewFactory.create_batch(count)
+            for course in courses:
+                GroupCourseFactory.create(course=course, group__organization=self.my_org)
+                PublicCourseFactory.create(course=course)
+            OrganizationCourseFactory.create_for(self.my_org, courses=courses)
+
+        create_courses(2)
+        with CaptureQueriesContext(connection) as small_page:
+            response = client.get(self.url)
+        assert len(response.json()['results']) == 2
+
+        create_courses(8)
+        with django_assert_max_num_queries(len(small_page.captured_queries)):
+            response = client.get(self.url)
+        assert len(response.json()['results']) == 10
+
     @pytest.mark.parametrize('org_name, status_code, skip_response_check', [
         ['my_org', HTTP_200_OK, False],
         ['other_org', HTTP_404_NOT_FOUND, True],
@@ -576,6 +706,89 @@ class TestMembershipRuleViewSet(ViewSetTestBase):
         assert MembershipRule.objects.count() == expected_post_delete_count
 
 
+class TestMembershipRuleSimulation(ViewSetTestBase):
+    """
+    Tests for the MembershipRuleViewSet simulate API.
+    """
+
+    url = '/membership-rules/simulate/'
+
+    @pytest.fixture(autouse=True)
+    def setup_users(self, setup):
+        self.group = CourseAccessGroupFactory.create(organization=self.my_org)
+        self.other_group = CourseAccessGroupFactory.create(organization=self.my_org)
+        self.learners = [
+            UserOrganizationMappingFactory.create(organization=self.my_org, user__email=email).user
+            for email in ['a@learners.org', 'b@learners.org', 'c@cs.university.edu', 'd@gmail.com']
+        ]
+        MembershipFactory.create(user=self.learners[1], group=self.other_group, automatic=True)
+        # Users of other organizations should never be evaluated
+        UserOrganizationMappingFactory.create(organization=self.other_org, user__email='e@learners.org')
+
+    def simulate(self, client, rules, **kwargs):
+        return client.post(self.url, json.dumps(dict(rules=rules, **kwargs)), content_type='application/json')
+
+    def test_counts(self, client):
+        response = self.simulate(client, [
+            {'domain': 'learners.org', 'group': self.group.id},
+            {'domain': '*.university.edu', 'group': self.other_group.id},
+        ])
+        assert response.status_code == HTTP_200_OK, response.content
+        result = response.json()
+        assert result['matched_users'] == 3
+        assert result['changed_users'] == 3
+        assert result['domains'] == [
+            {'domain': 'cs.university.edu', 'users': 1},
+            {'domain': 'learners.org', 'users': 2},
+        ]
+        assert sorted(result['changes'], key=json.dumps) == sorted([
+            {'from_group': None, 'to_group': self.group.id, 'users': 1},
+            {'from_group': self.other_group.id, 'to_group': self.group.id, 'users': 1},
+            {'from_group': None, 'to_group': self.other_group.id, 'users': 1},
+        ], key=json.dumps)
+
+    def test_removed_memberships(self, client):
+        response = self.simulate(client, [])
+        assert response.status_code == HTTP_200_OK, response.content
+        assert response.json()['changes'] == [{'from_group': self.other_group.id, 'to_group': None, 'users': 1}]
+
+    def test_streamed_users(self, client):
+        response = self.simulate(client, [{'domain': 'learners.org', 'group': self.group.id}], include_users=True)
+        assert response.status_code == HTTP_200_OK
+        assert response['Content-Type'] == 'application/x-ndjson'
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        assert [json.loads(line) for line in lines] == [
+            {
+                'user_id': self.learners[0].id,
+                'email': 'a@learners.org',
+                'from_group': None,
+                'to_group': self.group.id,
+            },
+            {
+                'user_id': self.learners[1].id,
+                'email': 'b@learners.org',
+                'from_group': self.other_group.id,
+                'to_group': self.group.id,
+            },
+        ]
+
+    def test_no_writes(self, client):
+        response = self.simulate(client, [{'domain': 'learners.org', 'group': self.group.id}])
+        assert response.status_code == HTTP_200_OK, response.content
+        assert not MembershipRule.objects.exists()
+        memberships = list(Membership.objects.values_list('user_id', 'group_id'))
+        assert memberships == [(self.learners[1].id, self.other_group.id)], 'Should not change memberships'
+
+    def test_invalid_domain(self, client):
+        response = self.simulate(client, [{'domain': 'not a domain', 'group': self.group.id}])
+        assert response.status_code == HTTP_400_BAD_REQUEST, response.content
+
+    def test_other_organization_group(self, client):
+        group = CourseAccessGroupFactory.create(organization=self.other_org)
+        response = self.simulate(client, [{'domain': 'learners.org', 'group': group.id}])
+        assert response.status_code == HTTP_400_BAD_REQUEST, response.content
+
+
 class TestPublicCourseViewSet(ViewSetTestBase):
     """
     Tests for the PublicCourseViewSet APIs.
@@ -613,6 +826,26 @@ class TestPublicCourseViewSet(ViewSetTestBase):
         results = response.json()['results']
         assert len(results) == expected_count
 
+    def test_list_queries_independent_of_page_size(self, client, django_assert_max_num_queries):
+        """
+        Ensure the course field resolves the courses of the whole page with a single query.
+        """
+        def create_flags(count):
+            courses = [flag.course for flag in PublicCourseFactory.create_batch(count)]
+            OrganizationCourseFactory.create_for(self.my_org, courses=courses)
+
+        create_flags(2)
+        with CaptureQueriesContext(connection) as small_page:
+            response = client.get(self.url)
+        assert len(response.json()['results']) == 2
+
+        create_flags(8)
+        with django_assert_max_num_queries(len(small_page.captured_queries)):
+            response = client.get(self.url)
+        results = response.json()['results']
+        assert len(results) == 10
+        assert all(result['course']['name'] for result in results)
+
     @pytest.mark.parametrize('org_name, status_code, skip_response_check', [
         ['my_org', HTTP_200_OK, False],
         ['other_org', HTTP_404_NOT_FOUND, True],
@@ -705,6 +938,41 @@ class TestGroupCourseViewSet(ViewSetTestBase):
         results = response.json()['results']
         assert len(results) == expected_count
 
+    def test_list_links_cursor_pagination(self, client):
+        courses = CourseOverviewFactory.create_batch(3)
+        OrganizationCourseFactory.create_for(self.my_org, courses=courses)
+        links = [GroupCourseFactory.create(group__organization=self.my_org, course=course) for course in courses]
+        response = client.get(self.url, {'pagination': 'cursor', 'limit': 2})
+        assert response.status_code == HTTP_200_OK, response.content
+        first_page = response.json()
+        response = client.get(first_page['next'])
+        assert response.status_code == HTTP_200_OK, response.content
+        second_page = response.json()
+
+        assert [link['id'] for link in first_page['results'] + second_page['results']] == [link.id for link in links]
+        assert second_page['next'] is None
+        assert 'count' not in first_page
+
+    def test_list_queries_independent_of_page_size(self, client, django_assert_max_num_queries):
+        """
+        Ensure the course and group fields don't add queries per link.
+        """
+        def create_links(count):
+            courses = CourseOverviewFactory.create_batch(count)
+            OrganizationCourseFactory.create_for(self.my_org, courses=courses)
+            for course in courses:
+                GroupCourseFactory.create(group__organization=self.my_org, course=course)
+
+        create_links(2)
+        with CaptureQueriesContext(connection) as small_page:
+            response = client.get(self.url)
+        assert len(response.json()['results']) == 2
+
+        create_links(8)
+        with django_assert_max_num_queries(len(small_page.captured_queries)):
+            response = client.get(self.url)
+        assert len(response.json()['results']) == 10
+
     @pytest.mark.parametrize('org_name, status_code, skip_response_check', [
         ['my_org', HTTP_200_OK, False],
         ['other_org', HTTP_404_NOT_FOUND, True],
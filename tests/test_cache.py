@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for the caching helpers.
+"""
+
+
+import pytest
+from django.core.cache import cache
+from mock import patch
+
+from course_access_groups.cache import (
+    LRUCache,
+    TwoTierCache,
+    clear_local_caches,
+    clear_request_cache,
+    get_cache_stats,
+    get_request_cache,
+    reset_request_cache,
+    start_request_cache,
+)
+
+
+class TestRequestCache:
+    """
+    Tests for the request-scoped cache.
+    """
+
+    def test_no_cache_outside_requests(self):
+        assert get_request_cache() is None
+        reset_request_cache()
+        assert get_request_cache() is None, 'Reset should not start a cache outside requests'
+
+    def test_request_lifecycle(self):
+        start_request_cache()
+        get_request_cache()['key'] = 'value'
+        assert get_request_cache() == {'key': 'value'}
+
+        reset_request_cache()
+        assert get_request_cache() == {}, 'Reset should empty the cache but keep it usable'
+
+        clear_request_cache()
+        assert get_request_cache() is None
+
+
+class TestLRUCache:
+    """
+    Tests for the in-process LRUCache.
+    """
+
+    def test_get_set_delete(self):
+        local_cache = LRUCache()
+        assert local_cache.get('key') is None
+        assert local_cache.get('key', 'default') == 'default'
+        local_cache.set('key', 'value')
+        assert local_cache.get('key') == 'value'
+        local_cache.delete('key')
+        assert local_cache.get('key') is None
+
+    def test_eviction(self):
+        local_cache = LRUCache(maxsize=2)
+        local_cache.set('a', 1)
+        local_cache.set('b', 2)
+        local_cache.get('a')  # Makes `b` the least recently used
+        local_cache.set('c', 3)
+        assert local_cache.get('a') == 1
+        assert local_cache.get('b') is None, 'Should evict the least recently used value'
+        assert local_cache.get('c') == 3
+
+    def test_expiry(self):
+        local_cache = LRUCache(timeout=10)
+        with patch('course_access_groups.cache.time.monotonic', return_value=100):
+            local_cache.set('key', 'value')
+        with patch('course_access_groups.cache.time.monotonic', return_value=105):
+            assert local_cache.get('key') == 'value'
+        with patch('course_access_groups.cache.time.monotonic', return_value=111):
+            assert local_cache.get('key') is None, 'Should expire'
+
+    def test_clear_local_caches(self):
+        local_cache = LRUCache()
+        local_cache.set('key', 'value')
+        clear_local_caches()
+        assert local_cache.get('key') is None
+
+    def test_size_and_timeout_settings(self, settings):
+        settings.COURSE_ACCESS_GROUPS_LOCAL_CACHE_SIZE = 1
+        settings.COURSE_ACCESS_GROUPS_LOCAL_CACHE_TIMEOUT = 5
+        local_cache = LRUCache()
+        with patch('course_access_groups.cache.time.monotonic', return_value=100):
+            local_cache.set('a', 1)
+            local_cache.set('b', 2)
+            assert local_cache.get('a') is None, 'Should respect the size setting'
+        with patch('course_access_groups.cache.time.monotonic', return_value=106):
+            assert local_cache.get('b') is None, 'Should respect the timeout setting'
+
+
+class TestTwoTierCache:
+    """
+    Tests for the TwoTierCache.
+    """
+
+    @pytest.fixture(autouse=True)
+    def setup(self):
+        cache.clear()
+        self.two_tier_cache = TwoTierCache('test_two_tier')
+        yield
+        cache.clear()
+
+    def test_tiers(self):
+        assert self.two_tier_cache.get('key') is None
+        self.two_tier_cache.set('key', 'value')
+        assert cache.get('course_access_groups.test_two_tier.key') == 'value', 'Should set the shared tier'
+        assert self.two_tier_cache.get('key') == 'value'
+
+        cache.delete('course_access_groups.test_two_tier.key')
+        assert self.two_tier_cache.get('key') == 'value', 'Should use the local tier'
+
+        clear_local_caches()
+        assert self.two_tier_cache.get('key') is None
+
+    def test_local_tier_miss(self):
+        cache.set('course_access_groups.test_two_tier.key', 'value')
+        assert self.two_tier_cache.get('key') == 'value', 'Should fallback to the shared tier'
+        cache.delete('course_access_groups.test_two_tier.key')
+        assert self.two_tier_cache.get('key') == 'value', 'Should fill the local tier'
+
+    def test_delete(self):
+        self.two_tier_cache.set('key', 'value')
+        self.two_tier_cache.delete('key')
+        assert self.two_tier_cache.get('key') is None
+        assert cache.get('course_access_groups.test_two_tier.key') is None
+
+    def test_get_set_many(self):
+        self.two_tier_cache.set_many({'a': 1, 'b': 2})
+        clear_local_caches()
+        self.two_tier_cache.set('c', 3)
+        assert self.two_tier_cache.get_many(['a', 'b', 'c', 'd']) == {'a': 1, 'b': 2, 'c': 3}
+
+    def test_stats(self):
+        self.two_tier_cache.get('key')  # Miss both tiers
+        self.two_tier_cache.set('key', 'value')
+        self.two_tier_cache.get('key')  # Local hit
+        clear_local_caches()
+        self.two_tier_cache.get('key')  # Shared hit
+        assert get_cache_stats()['test_two_tier'] == {
+            'local_hits': 1,
+            'local_misses': 2,
+            'shared_hits': 1,
+            'shared_misses': 1,
+        }
+
+    def test_custom_timeout(self):
+        two_tier_cache = TwoTierCache('test_custom_timeout', timeout=lambda: 5)
+        with patch('course_access_groups.cache.cache.set') as mock_set:
+            two_tier_cache.set('key', 'value')
+        mock_set.assert_called_once_with('course_access_groups.test_custom_timeout.key', 'value', 5)
@@ -6,6 +6,7 @@ Tests for the feature flag helper.
 
 import pytest
 
+from course_access_groups.cache import start_request_cache
 from course_access_groups.feature_flag import ConfigurationError, is_feature_enabled
 from test_utils import patch_site_configs
 
@@ -16,7 +17,7 @@ def test_is_feature_enabled(settings, expected_feature_enabled):
     Ensure `is_feature_enabled()` respects the `ENABLE_COURSE_ACCESS_GROUPS` Site Configuration value.
     """
 
-    settings.FEATURES['ORGANIZATIONS_APP'] = True
+    settings.FEATURES = dict(settings.FEATURES, ORGANIZATIONS_APP=True)
 
     with patch_site_configs({'ENABLE_COURSE_ACCESS_GROUPS': expected_feature_enabled}):
         assert is_feature_enabled() == expected_feature_enabled
@@ -27,7 +28,7 @@ def test_is_feature_disabled_org_disabled(settings):
     Ensure `is_feature_enabled()` returns False when both Org App and the feature flag is disabled.
     """
 
-    settings.FEATURES['ORGANIZATIONS_APP'] = False
+    settings.FEATURES = dict(settings.FEATURES, ORGANIZATIONS_APP=False)
 
     with patch_site_configs({'ENABLE_COURSE_ACCESS_GROUPS': False}):
         assert not is_feature_enabled()
@@ -38,8 +39,32 @@ def test_is_feature_enabled_but_orgs_disabled(settings):
     Ensure `is_feature_enabled()` panic with an exception when Org App is disabled but the feature flag is enabled.
     """
 
-    settings.FEATURES['ORGANIZATIONS_APP'] = False
+    settings.FEATURES = dict(settings.FEATURES, ORGANIZATIONS_APP=False)
 
     with patch_site_configs({'ENABLE_COURSE_ACCESS_GROUPS': True}):
         with pytest.raises(ConfigurationError):
             is_feature_enabled()  # Should throw configuration error due to missing organization app.
+
+
+def test_is_feature_enabled_memoized_within_request():
+    """
+    Ensure `is_feature_enabled()` reads the Site Configuration once per request.
+    """
+    start_request_cache()
+    with patch_site_configs({'ENABLE_COURSE_ACCESS_GROUPS': True}):
+        assert is_feature_enabled()
+
+    with patch_site_configs({'ENABLE_COURSE_ACCESS_GROUPS': False}):
+        assert is_feature_enabled(), 'Should reuse the value of the current request'
+
+
+def test_organizations_app_read_once(settings):
+    """
+    Ensure `ORGANIZATIONS_APP` is read on startup (or settings override) instead of on every check.
+    """
+    settings.FEATURES = dict(settings.FEATURES, ORGANIZATIONS_APP=False)
+    settings.FEATURES['ORGANIZATIONS_APP'] = True  # In-place changes aren't picked up
+
+    with patch_site_configs({'ENABLE_COURSE_ACCESS_GROUPS': True}):
+        with pytest.raises(ConfigurationError):
+            is_feature_enabled()
@@ -0,0 +1,168 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for the materialized UserCourseAccess table.
+"""
+
+
+import pytest
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from organizations.models import OrganizationCourse
+
+from course_access_groups.models import UserCourseAccess
+from course_access_groups.openedx_modules import CourseOverview
+from course_access_groups.permissions import filter_courses_for_user
+from test_utils.factories import (
+    CourseAccessGroupFactory,
+    CourseOverviewFactory,
+    GroupCourseFactory,
+    MembershipFactory,
+    OrganizationFactory,
+    PublicCourseFactory,
+    UserFactory
+)
+
+
+def get_access_rows():
+    """
+    Get the materialized rows as a set of (user_id, course_id string, reason) tuples.
+    """
+    return {
+        (user_id, str(course_id), reason)
+        for user_id, course_id, reason in UserCourseAccess.objects.values_list('user_id', 'course_id', 'reason')
+    }
+
+
+@pytest.mark.django_db
+class TestMaterializedAccess:
+    """
+    Tests for maintaining the UserCourseAccess table via signals.
+    """
+
+    @pytest.fixture(autouse=True)
+    def setup(self, settings):
+        settings.COURSE_ACCESS_GROUPS_MATERIALIZE_ACCESS = True
+        self.organization = OrganizationFactory.create()
+        self.group = CourseAccessGroupFactory.create(organization=self.organization)
+        self.course = CourseOverviewFactory.create()
+        self.user = UserFactory.create()
+
+    def test_disabled_by_default(self, settings):
+        settings.COURSE_ACCESS_GROUPS_MATERIALIZE_ACCESS = False
+        GroupCourseFactory.create(group=self.group, course=self.course)
+        MembershipFactory.create(group=self.group, user=self.user)
+        PublicCourseFactory.create()
+        assert not UserCourseAccess.objects.exists()
+
+    def test_group_courses(self):
+        group_course = GroupCourseFactory.create(group=self.group, course=self.course)
+        membership = MembershipFactory.create(group=self.group, user=self.user)
+        expected_row = (self.user.id, str(self.course.id), UserCourseAccess.REASON_GROUP)
+        assert get_access_rows() == {expected_row}, 'Should grant existing courses to new members'
+
+        membership.delete()
+        assert not get_access_rows(), 'Should revoke access of deleted memberships'
+
+        MembershipFactory.create(group=self.group, user=self.user)
+        group_course.delete()
+        assert not get_access_rows(), 'Should revoke access of deleted group courses'
+
+        GroupCourseFactory.create(group=self.group, course=self.course)
+        assert get_access_rows() == {expected_row}, 'Should grant new courses to existing members'
+
+    def test_move_membership(self):
+        other_group = CourseAccessGroupFactory.create(organization=self.organization)
+        other_course = GroupCourseFactory.create(group=other_group).course
+        GroupCourseFactory.create(group=self.group, course=self.course)
+        membership = MembershipFactory.create(group=self.group, user=self.user)
+
+        membership.group = other_group
+        membership.save()
+        assert get_access_rows() == {(self.user.id, str(other_course.id), UserCourseAccess.REASON_GROUP)}
+
+    def test_update_group_course(self):
+        group_course = GroupCourseFactory.create(group=self.group, course=self.course)
+        MembershipFactory.create(group=self.group, user=self.user)
+        other_course = CourseOverviewFactory.create()
+
+        group_course.course = other_course
+        group_course.save()
+        assert get_access_rows() == {
+            (self.user.id, str(other_course.id), UserCourseAccess.REASON_GROUP),
+        }, 'Should revoke the old course'
+
+        other_group = CourseAccessGroupFactory.create(organization=self.organization)
+        other_member = MembershipFactory.create(group=other_group).user
+        group_course.group = other_group
+        group_course.save()
+        assert get_access_rows() == {
+            (other_member.id, str(other_course.id), UserCourseAccess.REASON_GROUP),
+        }, 'Should revoke the course from the old group members'
+
+    def test_update_membership_user(self):
+        GroupCourseFactory.create(group=self.group, course=self.course)
+        membership = MembershipFactory.create(group=self.group, user=self.user)
+        other_user = UserFactory.create()
+
+        membership.user = other_user
+        membership.save()
+        assert get_access_rows() == {(other_user.id, str(self.course.id), UserCourseAccess.REASON_GROUP)}
+
+    def test_public_courses(self):
+        public_course = PublicCourseFactory.create(course=self.course)
+        assert get_access_rows() == {(None, str(self.course.id), UserCourseAccess.REASON_PUBLIC)}
+        public_course.delete()
+        assert not get_access_rows()
+
+    def test_update_public_course(self):
+        public_course = PublicCourseFactory.create(course=self.course)
+        other_course = CourseOverviewFactory.create()
+
+        public_course.course = other_course
+        public_course.save()
+        assert get_access_rows() == {(None, str(other_course.id), UserCourseAccess.REASON_PUBLIC)}
+
+    def test_filter_courses_for_user(self):
+        GroupCourseFactory.create(group=self.group, course=self.course)
+        MembershipFactory.create(group=self.group, user=self.user)
+        public_course = PublicCourseFactory.create().course
+        CourseOverviewFactory.create()  # Private course
+
+        courses = filter_courses_for_user(self.user, CourseOverview.objects.all())
+        assert sorted(str(course.id) for course in courses) == sorted([str(self.course.id), str(public_course.id)])
+
+
+@pytest.mark.django_db
+class TestRebuildUserCourseAccessCommand:
+    """
+    Tests for the `rebuild_user_course_access` management command.
+    """
+
+    @pytest.fixture(autouse=True)
+    def setup(self):
+        self.organization = OrganizationFactory.create()
+        group = CourseAccessGroupFactory.create(organization=self.organization)
+        self.group_course = GroupCourseFactory.create(group=group).course
+        self.public_course = PublicCourseFactory.create().course
+        self.users = UserFactory.create_batch(3)
+        for user in self.users:
+            MembershipFactory.create(group=group, user=user)
+        for course in [self.group_course, self.public_course]:
+            OrganizationCourse.objects.create(course_id=str(course.id), organization=self.organization)
+
+    def test_rebuild(self):
+        stale_row = UserCourseAccess.objects.create(user=self.users[0], course=self.public_course, reason='group')
+        call_command('rebuild_user_course_access', organizations=[self.organization.short_name], batch_size=2)
+
+        assert not UserCourseAccess.objects.filter(pk=stale_row.pk).exists(), 'Should remove drifted rows'
+        assert get_access_rows() == {(None, str(self.public_course.id), UserCourseAccess.REASON_PUBLIC)} | {
+            (user.id, str(self.group_course.id), UserCourseAccess.REASON_GROUP) for user in self.users
+        }
+
+    def test_rebuild_all(self):
+        call_command('rebuild_user_course_access')
+        assert len(get_access_rows()) == 4
+
+    def test_unknown_organization(self):
+        with pytest.raises(CommandError, match='Organizations not found: unknown'):
+            call_command('rebuild_user_course_access', organizations=['unknown'])
@@ -0,0 +1,374 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for applying MembershipRule to existing users.
+"""
+
+
+import threading
+import time
+from io import StringIO
+
+import pytest
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import OperationalError, connections
+from mock import patch
+from tahoe_sites.tests.utils import create_organization_mapping
+
+from course_access_groups.membership_rules import (
+    _run_worker,
+    apply_membership_rules,
+    backfill_organization_memberships,
+    defer_membership_rules,
+    iterate_user_batches,
+    process_pending_users,
+    reevaluate_membership_rules,
+    simulate_membership_rules,
+)
+from course_access_groups.models import Membership
+from course_access_groups.permissions import get_user_membership_group
+from course_access_groups.rule_index import MembershipRuleIndex
+from course_access_groups.signals import on_learner_account_activated, on_learner_register
+from test_utils.factories import (
+    CourseAccessGroupFactory,
+    MembershipFactory,
+    MembershipRuleFactory,
+    UserFactory,
+)
+
+
+@pytest.mark.django_db
+class TestBackfillOrganizationMemberships:
+    """
+    Tests for the backfill_organization_memberships helper and its management command.
+    """
+
+    @pytest.fixture(autouse=True)
+    def setup(self):
+        self.group = CourseAccessGroupFactory.create()
+        self.organization = self.group.organization
+        MembershipRuleFactory.create(domain='example.com', group=self.group)
+
+    def create_user(self, email, **kwargs):
+        user = UserFactory.create(email=email, **kwargs)
+        create_organization_mapping(user=user, organization=self.organization)
+        return user
+
+    def test_iterate_user_batches(self):
+        users = UserFactory.create_batch(5)
+        batches = list(iterate_user_batches(get_user_model().objects.all(), batch_size=2))
+        assert [len(batch) for batch in batches] == [2, 2, 1]
+        assert [user_id for batch in batches for user_id, _email in batch] == [user.id for user in users]
+
+    def test_backfill(self):
+        matching = self.create_user('first@example.com')
+        not_matching = self.create_user('second@other.com')
+        assert backfill_organization_memberships(self.organization, batch_size=1) == (2, 1)
+        membership = Membership.objects.get(user=matching)
+        assert membership.group == self.group
+        assert membership.automatic
+        assert not Membership.objects.filter(user=not_matching).exists()
+
+    def test_skipped_users(self):
+        member = self.create_user('member@example.com')
+        other_group = CourseAccessGroupFactory.create(organization=self.organization)
+        MembershipFactory.create(user=member, group=other_group)
+        inactive = self.create_user('inactive@example.com', is_active=False)
+        outsider = UserFactory.create(email='outsider@example.com')
+
+        assert backfill_organization_memberships(self.organization) == (0, 0)
+        assert Membership.objects.get(user=member).group == other_group, 'Existing memberships should be kept'
+        assert not Membership.objects.filter(user__in=[inactive, outsider]).exists()
+
+    def test_organization_without_rules(self):
+        group = CourseAccessGroupFactory.create()
+        user = UserFactory.create(email='learner@example.com')
+        create_organization_mapping(user=user, organization=group.organization)
+        assert backfill_organization_memberships(group.organization) == (0, 0), 'Should skip users without rules'
+        assert not Membership.objects.exists()
+
+    def test_invalidates_cached_groups(self):
+        user = self.create_user('learner@example.com')
+        assert get_user_membership_group(user) is None
+        backfill_organization_memberships(self.organization)
+        assert get_user_membership_group(user) == (self.group.id, self.organization.id)
+
+    def test_progress_callback(self):
+        for i in range(3):
+            self.create_user('learner{}@example.com'.format(i))
+        progress = []
+        backfill_organization_memberships(
+            self.organization,
+            batch_size=2,
+            progress_callback=lambda processed, assigned: progress.append((processed, assigned)),
+        )
+        assert progress == [(2, 2), (3, 3)]
+
+    def test_command(self):
+        self.create_user('learner@example.com')
+        stdout = StringIO()
+        call_command(
+            'backfill_membership_rules',
+            organizations=[self.organization.short_name],
+            batch_size=10,
+            stdout=stdout,
+        )
+        assert Membership.objects.count() == 1
+        output = stdout.getvalue()
+        assert 'users/second' in output
+        assert 'Assigned 1 of 1 users' in output
+
+    def test_command_missing_organization(self):
+        with pytest.raises(CommandError, match='Organizations not found: missing_org'):
+            call_command('backfill_membership_rules', organizations=['missing_org'])
+
+
+@pytest.mark.django_db
+class TestDeferredMembershipRules:
+    """
+    Tests for the opt-in background processing of the registration signals.
+    """
+
+    @pytest.fixture(autouse=True)
+    def setup(self, settings):
+        settings.COURSE_ACCESS_GROUPS_DEFER_MEMBERSHIP_RULES = True
+        self.group = CourseAccessGroupFactory.create()
+        self.organization = self.group.organization
+        MembershipRuleFactory.create(domain='example.com', group=self.group)
+        # Tests run inside a transaction which never commits, and the worker thread can't see uncommitted rows.
+        with patch('course_access_groups.membership_rules.transaction.on_commit', side_effect=lambda func: func()):
+            with patch('course_access_groups.membership_rules._executor') as self.mock_executor:
+                yield
+        process_pending_users()  # Don't leak queued users to other tests
+
+    def create_user(self, email, **kwargs):
+        user = UserFactory.create(email=email, **kwargs)
+        create_organization_mapping(user=user, organization=self.organization)
+        return user
+
+    @pytest.mark.parametrize('receiver_function', [
+        on_learner_account_activated,
+        on_learner_register,
+    ])
+    def test_deferred_receivers(self, receiver_function):
+        user = self.create_user('learner@example.com')
+        receiver_function(object(), user)
+        assert not Membership.objects.filter(user=user).exists(), 'Should not run in the request'
+        self.mock_executor.submit.assert_called_once_with(_run_worker, process_pending_users)
+
+        assert process_pending_users() == 1
+        assert Membership.objects.get(user=user).group == self.group
+
+    def test_batched_processing(self, django_assert_max_num_queries):
+        """
+        Ensure many users are processed with a fixed number of queries.
+        """
+        users = [self.create_user('learner{}@example.com'.format(i)) for i in range(5)]
+        users.append(self.create_user('other@other.com'))
+        users.append(self.create_user('inactive@example.com', is_active=False))
+        for user in users:
+            defer_membership_rules(user.pk)
+
+        with django_assert_max_num_queries(6):
+            assert process_pending_users(batch_size=100) == 7
+        assert Membership.objects.filter(user__in=users, automatic=True).count() == 5
+
+    def test_batch_size(self):
+        users = [self.create_user('learner{}@example.com'.format(i)) for i in range(3)]
+        for user in users:
+            defer_membership_rules(user.pk)
+
+        with patch(
+            'course_access_groups.membership_rules.apply_membership_rules',
+            wraps=apply_membership_rules,
+        ) as mock_apply:
+            assert process_pending_users(batch_size=2) == 3
+        assert [len(call[0][0]) for call in mock_apply.call_args_list] == [2, 1]
+
+    def test_errors_are_logged(self, caplog):
+        defer_membership_rules(self.create_user('learner@example.com').pk)
+        with patch('course_access_groups.membership_rules.apply_membership_rules', side_effect=ValueError):
+            assert process_pending_users() == 1
+        assert 'Error applying membership rules' in caplog.text
+
+
+@pytest.mark.django_db(transaction=True)
+class TestConcurrentCreateFromRules:
+    """
+    Stress test `Membership.create_from_rules` against parallel signal delivery.
+    """
+
+    THREADS = 8
+
+    def call_in_thread(self, user, barrier, results):
+        """
+        Call `create_from_rules` once all threads are ready, retrying the SQLite table locks.
+
+        SQLite serializes writers by raising `OperationalError` which isn't what's being tested here, unlike
+        `IntegrityError` which is caused by racing inserts.
+        """
+        try:
+            barrier.wait()
+            for _attempt in range(20):
+                try:
+                    results.append(Membership.create_from_rules(user))
+                    return
+                except OperationalError:
+                    time.sleep(0.05)
+        except Exception as exc:
+            results.append(exc)
+        finally:
+            connections.close_all()
+
+    @pytest.fixture(autouse=True)
+    def setup(self):
+        # Rule changes schedule a background re-evaluation job which would compete for the SQLite locks.
+        with patch('course_access_groups.membership_rules._executor'):
+            yield
+
+    def test_parallel_signals(self):
+        group = CourseAccessGroupFactory.create()
+        MembershipRuleFactory.create(domain='example.com', group=group)
+        user = UserFactory.create(email='learner@example.com', is_active=True)
+        create_organization_mapping(user=user, organization=group.organization)
+
+        barrier = threading.Barrier(self.THREADS)
+        results = []
+        threads = [
+            threading.Thread(target=self.call_in_thread, args=(user, barrier, results))
+            for _i in range(self.THREADS)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert len(results) == self.THREADS
+        assert not [result for result in results if isinstance(result, Exception)], 'Should not raise IntegrityError'
+        assert {membership.pk for membership in results} == {Membership.objects.get(user=user).pk}
+        assert Membership.objects.filter(user=user).count() == 1
+
+    def test_existing_membership(self, django_assert_max_num_queries):
+        """
+        Ensure the upsert keeps existing memberships, with an INSERT and a SELECT only.
+        """
+        group = CourseAccessGroupFactory.create()
+        MembershipRuleFactory.create(domain='example.com', group=group)
+        user = UserFactory.create(email='learner@example.com', is_active=True)
+        create_organization_mapping(user=user, organization=group.organization)
+        manual_membership = MembershipFactory.create(user=user, group=CourseAccessGroupFactory.create())
+        Membership.create_from_rules(user)  # Warm up the rule cache
+
+        with django_assert_max_num_queries(4) as captured:  # Organization, INSERT, SELECT and SQLite BEGIN
+            assert Membership.create_from_rules(user) == manual_membership
+        assert not [query for query in captured.captured_queries if 'SAVEPOINT' in query['sql']]
+        assert not Membership.objects.get(user=user).automatic
+
+
+@pytest.mark.django_db
+class TestReevaluateMembershipRules:
+    """
+    Tests for re-evaluating automatic memberships on MembershipRule changes.
+    """
+
+    @pytest.fixture(autouse=True)
+    def setup(self):
+        self.group = CourseAccessGroupFactory.create()
+        self.organization = self.group.organization
+        self.other_group = CourseAccessGroupFactory.create(organization=self.organization)
+        self.rule = MembershipRuleFactory.create(domain='example.com', group=self.group)
+
+    def create_user(self, email, group=None, automatic=True):
+        user = UserFactory.create(email=email)
+        create_organization_mapping(user=user, organization=self.organization)
+        if group:
+            MembershipFactory.create(user=user, group=group, automatic=automatic)
+        return user
+
+    def get_group_id(self, user):
+        return Membership.objects.filter(user=user).values_list('group_id', flat=True).first()
+
+    def test_moved_group(self):
+        automatic = self.create_user('automatic@example.com', group=self.group)
+        manual = self.create_user('manual@example.com', group=self.group, automatic=False)
+        self.rule.group = self.other_group
+        self.rule.save()
+
+        counts = reevaluate_membership_rules(self.organization.id, ['example.com'])
+        assert counts == {'created': 0, 'moved': 1, 'removed': 0}
+        assert self.get_group_id(automatic) == self.other_group.id
+        assert self.get_group_id(manual) == self.group.id, 'Manual memberships should be kept'
+        assert get_user_membership_group(automatic) == (self.other_group.id, self.organization.id)
+
+    def test_changed_domain(self):
+        old_domain_user = self.create_user('old@example.com', group=self.group)
+        new_domain_user = self.create_user('new@example.org')
+        unrelated_user = self.create_user('unrelated@other.com', group=self.group)  # e.g. Due to a deleted rule
+        self.rule.domain = 'example.org'
+        self.rule.save()
+
+        counts = reevaluate_membership_rules(self.organization.id, ['example.com', 'example.org'], batch_size=1)
+        assert counts == {'created': 1, 'moved': 0, 'removed': 1}
+        assert not self.get_group_id(old_domain_user)
+        assert self.get_group_id(new_domain_user) == self.group.id
+        assert self.get_group_id(unrelated_user) == self.group.id, 'Only the changed domains should be evaluated'
+
+    def test_deleted_rule(self):
+        automatic = self.create_user('automatic@example.com', group=self.group)
+        manual = self.create_user('manual@example.com', group=self.group, automatic=False)
+        self.rule.delete()
+
+        assert reevaluate_membership_rules(self.organization.id, ['example.com'])['removed'] == 1
+        assert not self.get_group_id(automatic)
+        assert self.get_group_id(manual) == self.group.id, 'Manual memberships should be kept'
+
+    def test_subdomain_rules(self):
+        user = self.create_user('learner@cs.university.edu')
+        MembershipRuleFactory.create(domain='*.university.edu', group=self.other_group)
+        assert reevaluate_membership_rules(self.organization.id, ['*.university.edu'])['created'] == 1
+        assert self.get_group_id(user) == self.other_group.id
+
+    def test_scheduled_on_rule_changes(self):
+        with patch('course_access_groups.membership_rules.transaction.on_commit', side_effect=lambda func: func()):
+            with patch('course_access_groups.membership_rules._executor') as mock_executor:
+                self.rule.domain = 'example.org'
+                self.rule.save()
+                mock_executor.submit.assert_called_once_with(
+                    _run_worker,
+                    reevaluate_membership_rules,
+                    self.organization.id,
+                    ['example.com', 'example.org'],
+                )
+
+                mock_executor.reset_mock()
+                self.rule.delete()
+                mock_executor.submit.assert_called_once_with(
+                    _run_worker,
+                    reevaluate_membership_rules,
+                    self.organization.id,
+                    ['example.org'],
+                )
+
+
+@pytest.mark.django_db
+class TestSimulateMembershipRules:
+    """
+    Tests for the simulate_membership_rules helper.
+    """
+
+    def test_single_aggregated_query(self, django_assert_num_queries):
+        group = CourseAccessGroupFactory.create()
+        for email in ['a@example.com', 'b@EXAMPLE.com', 'c@other.com']:
+            user = UserFactory.create(email=email)
+            create_organization_mapping(user=user, organization=group.organization)
+
+        rule_index = MembershipRuleIndex.from_rules([('example.com', group.id)])
+        with django_assert_num_queries(1):
+            result = simulate_membership_rules(group.organization, rule_index)
+        assert result == {
+            'matched_users': 2,
+            'changed_users': 2,
+            'domains': [{'domain': 'example.com', 'users': 2}],
+            'changes': [{'from_group': None, 'to_group': group.id, 'users': 2}],
+        }
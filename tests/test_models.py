@@ -23,6 +23,7 @@ class TestMembershipRuleModel:
         'example.com',
         'example.co.uk',
         'hello-world.org',
+        '*.example.com',
     ])
     def test_valid_domains(self, domain):
         rule = MembershipRuleFactory.create(domain=domain)
@@ -34,6 +35,8 @@ class TestMembershipRuleModel:
         '111',
         '===',
         ' example.com ',  # has spaces
+        '*example.com',
+        '*.*.example.com',
     ])
     def test_invalid_domains(self, domain):
         with pytest.raises(ValidationError):
@@ -6,7 +6,9 @@ Test the authentication and permission of Course Access Groups.
 
 import pytest
 from django.contrib.auth import get_user_model
+from django.contrib.auth.models import AnonymousUser
 from django.contrib.sites import shortcuts as sites_shortcuts
+from django.core.cache import cache
 from django.core.exceptions import MultipleObjectsReturned
 from mock import Mock, patch
 from openedx.core.lib.api.authentication import OAuth2Authentication
@@ -19,22 +21,37 @@ from tahoe_sites.api import (
     get_current_organization,
     get_uuid_by_organization,
 )
+from tahoe_sites.models import UserOrganizationMapping
 from tahoe_sites.tests.utils import create_organization_mapping
 
+from course_access_groups.cache import clear_local_caches, start_request_cache
+from course_access_groups.models import Membership
+from course_access_groups.openedx_modules import CourseOverview
 from course_access_groups.permissions import (
     CommonAuthMixin,
     IsSiteAdminUser,
+    filter_courses_for_user,
+    get_course_organization,
     get_requested_organization,
+    get_user_group_course_ids,
+    has_group_access,
     is_active_staff_or_superuser,
     is_course_with_public_access,
     is_organization_staff,
+    user_has_access_to_course,
+    user_has_access_to_courses,
 )
 from test_utils.factories import (
+    CourseAccessGroupFactory,
     CourseOverviewFactory,
+    GroupCourseFactory,
+    MembershipFactory,
+    MembershipRuleFactory,
     OrganizationFactory,
     PublicCourseFactory,
     SiteFactory,
-    UserFactory
+    UserFactory,
+    UserOrganizationMappingFactory,
 )
 
 
@@ -136,6 +153,56 @@ class TestGetRequestedOrganization:
                            match=r'Not permitted to use the `organization_uuid` parameter.'):
             get_requested_organization(request)
 
+    def test_memoized_on_request(self):
+        """
+        The organization is resolved once per request.
+        """
+        expected_info = create_tahoe_site(domain='my_site.org', short_name='any')
+        request = Mock(site=expected_info['site'], user=UserFactory.create(), GET={})
+
+        with patch('course_access_groups.permissions.get_current_organization',
+                   return_value=expected_info['organization']) as mock_get_current_organization:
+            assert get_requested_organization(request) == expected_info['organization']
+            assert get_requested_organization(request) == expected_info['organization']
+        mock_get_current_organization.assert_called_once_with(request)
+
+        other_request = Mock(site=expected_info['site'], user=UserFactory.create(), GET={})
+        with patch('course_access_groups.permissions.get_current_organization') as mock_get_current_organization:
+            get_requested_organization(other_request)
+        assert mock_get_current_organization.called, 'Should not be shared between requests'
+
+    def test_uuid_parameter_memoized_on_request(self, settings):
+        """
+        The `organization_uuid` organization is memoized too.
+        """
+        main_site = SiteFactory.create(domain='main_site')
+        settings.SITE_ID = main_site.id
+        customer_org = create_tahoe_site(domain='customer_site', short_name='any')['organization']
+        request = Mock(site=main_site, user=UserFactory.create(is_superuser=True), GET={
+            'organization_uuid': get_uuid_by_organization(customer_org),
+        })
+
+        with patch('course_access_groups.permissions.get_organization_by_uuid',
+                   return_value=customer_org) as mock_get_organization_by_uuid:
+            assert get_requested_organization(request) == customer_org
+            assert get_requested_organization(request) == customer_org
+        assert mock_get_organization_by_uuid.call_count == 1
+
+    def test_uuid_parameter_denied_is_not_memoized(self, settings):
+        """
+        A denied `organization_uuid` parameter keeps being denied for the rest of the request.
+        """
+        main_site = SiteFactory.create(domain='main_site')
+        settings.SITE_ID = main_site.id
+        customer_org = create_tahoe_site(domain='customer_site', short_name='any')['organization']
+        request = Mock(site=main_site, user=UserFactory.create(), GET={
+            'organization_uuid': get_uuid_by_organization(customer_org),
+        })
+
+        for _attempt in range(2):
+            with pytest.raises(PermissionDenied):
+                get_requested_organization(request)
+
 
 @pytest.mark.django_db
 class TestSiteAdminPermissions:
@@ -265,6 +332,38 @@ class TestOrganizationStaffHelper:
         )
         assert not is_organization_staff(user2, self.course)
 
+    def test_cached_admin_status(self, django_assert_num_queries):
+        learner = UserFactory.create()
+        assert is_organization_staff(self.user, self.course)
+        assert not is_organization_staff(learner, self.course)
+        with django_assert_num_queries(0):
+            assert not is_organization_staff(learner, self.course), 'Should cache non-admins'
+        with django_assert_num_queries(1):
+            assert is_organization_staff(self.user, self.course), 'Should not cache admins'
+
+    def test_admin_demoted_without_signals(self):
+        """
+        Demotions via `QuerySet.update` such as `update_admin_role_in_organization` should take effect immediately.
+        """
+        assert is_organization_staff(self.user, self.course)
+        UserOrganizationMapping.objects.filter(user=self.user, organization=self.org1).update(is_admin=False)
+        assert not is_organization_staff(self.user, self.course)
+
+    def test_admin_status_invalidation(self):
+        assert is_organization_staff(self.user, self.course)
+        mapping = UserOrganizationMapping.objects.get(user=self.user, organization=self.org1)
+        mapping.is_admin = False
+        mapping.save()
+        assert not is_organization_staff(self.user, self.course), 'Should invalidate on mapping changes'
+        mapping.delete()
+        create_organization_mapping(user=self.user, organization=self.org1, is_admin=True)
+        assert is_organization_staff(self.user, self.course), 'Should invalidate on new mappings'
+
+    def test_inactive_admin(self):
+        assert is_organization_staff(self.user, self.course)
+        self.user.is_active = False
+        assert not is_organization_staff(self.user, self.course), 'Cached admin status should not skip is_active'
+
     def test_multi_org_course(self):
         """
         Verify that is_organization_staff returns False if there are many active organization-course links
@@ -295,6 +394,59 @@ class TestOrganizationStaffHelper:
                 assert mock_log.call_count == 0
 
 
+@pytest.mark.django_db
+class TestGetCourseOrganization:
+    """
+    Tests for the cached permissions.get_course_organization helper.
+    """
+
+    @pytest.fixture(autouse=True)
+    def setup(self):
+        self.organization = OrganizationFactory.create()
+        self.course = CourseOverviewFactory.create()
+
+    def test_cached_organization(self, django_assert_num_queries):
+        OrganizationCourse.objects.create(course_id=str(self.course.id), organization=self.organization)
+        assert get_course_organization(self.course.id) == self.organization
+        with django_assert_num_queries(0):
+            assert get_course_organization(self.course.id) == self.organization
+
+    def test_shared_cache(self, django_assert_num_queries):
+        OrganizationCourse.objects.create(course_id=str(self.course.id), organization=self.organization)
+        assert get_course_organization(self.course.id) == self.organization
+        clear_local_caches()  # Simulate another process
+        with django_assert_num_queries(0):
+            assert get_course_organization(self.course.id) == self.organization
+
+    def test_cached_missing_organization(self, django_assert_num_queries):
+        with pytest.raises(Organization.DoesNotExist):
+            get_course_organization(self.course.id)
+        with django_assert_num_queries(0):
+            with pytest.raises(Organization.DoesNotExist):
+                get_course_organization(self.course.id)
+
+    def test_cached_multiple_organizations(self):
+        with patch(
+            'course_access_groups.permissions.get_organization_by_course',
+            side_effect=MultipleObjectsReturned()
+        ) as mock_get_organization:
+            with patch('course_access_groups.permissions.log.warning') as mock_log:
+                for _ in range(3):
+                    with pytest.raises(MultipleObjectsReturned):
+                        get_course_organization(self.course.id)
+        assert mock_get_organization.call_count == 1, 'Should cache the failed lookups'
+        assert mock_log.call_count == 1, 'Should not flood the logs'
+
+    def test_invalidation(self):
+        with pytest.raises(Organization.DoesNotExist):
+            get_course_organization(self.course.id)
+        course_link = OrganizationCourse.objects.create(course_id=str(self.course.id), organization=self.organization)
+        assert get_course_organization(self.course.id) == self.organization, 'Should invalidate on save'
+        course_link.delete()
+        with pytest.raises(Organization.DoesNotExist):
+            get_course_organization(self.course.id)
+
+
 @pytest.mark.django_db
 class TestIsCourseWithPublicAccessHelper:
     """
@@ -327,6 +479,298 @@ class TestIsCourseWithPublicAccessHelper:
         with patch('django.db.models.sql.query.check_rel_lookup_compatibility', return_value=False):
             assert is_course_with_public_access(course=course_descriptor)
 
+    def test_cached_public_courses(self, django_assert_num_queries):
+        PublicCourseFactory.create(course=self.my_course)
+        assert is_course_with_public_access(self.my_course)
+
+        other_course = CourseOverviewFactory.create(org=self.my_course.org)
+        with django_assert_num_queries(0):
+            assert is_course_with_public_access(self.my_course), 'Should use the organization cache'
+            assert not is_course_with_public_access(other_course), 'Should share the organization cache'
+
+    def test_cache_invalidation(self):
+        public_course = PublicCourseFactory.create(course=self.my_course)
+        assert is_course_with_public_access(self.my_course)
+        public_course.delete()
+        assert not is_course_with_public_access(self.my_course), 'Should invalidate on delete'
+        PublicCourseFactory.create(course=self.my_course)
+        assert is_course_with_public_access(self.my_course), 'Should invalidate on save'
+
+
+@pytest.mark.django_db
+class TestUserHasAccessToCourseMemoization:
+    """
+    Tests for the request-scoped memoization of permissions.user_has_access_to_course.
+    """
+
+    @pytest.fixture(autouse=True)
+    def setup(self):
+        self.user = UserFactory.create()
+        self.course = CourseOverviewFactory.create()
+        self.group = CourseAccessGroupFactory.create()
+        MembershipFactory.create(user=self.user, group=self.group)
+
+    def test_no_memoization_outside_requests(self):
+        with patch('course_access_groups.permissions._user_has_access_to_course', return_value=False) as mock_check:
+            assert not user_has_access_to_course(self.user, self.course)
+            assert not user_has_access_to_course(self.user, self.course)
+        assert mock_check.call_count == 2
+
+    def test_memoized_within_request(self):
+        start_request_cache()
+        with patch('course_access_groups.permissions._user_has_access_to_course', return_value=False) as mock_check:
+            assert not user_has_access_to_course(self.user, self.course)
+            assert not user_has_access_to_course(self.user, self.course)
+        assert mock_check.call_count == 1, 'Should reuse the decision'
+
+    def test_invalidated_on_changes(self):
+        start_request_cache()
+        assert not user_has_access_to_course(self.user, self.course)
+        GroupCourseFactory.create(course=self.course, group=self.group)
+        assert user_has_access_to_course(self.user, self.course), 'Should discard stale decisions'
+
+
+@pytest.mark.django_db
+class TestHasGroupAccess:
+    """
+    Tests for the permissions.has_group_access helper and its cache.
+    """
+
+    @pytest.fixture(autouse=True)
+    def setup(self):
+        self.user = UserFactory.create()
+        self.course = CourseOverviewFactory.create()
+        self.group = CourseAccessGroupFactory.create()
+        self.membership = MembershipFactory.create(user=self.user, group=self.group)
+
+    def test_no_access(self):
+        assert not has_group_access(self.user, self.course)
+
+    def test_group_course(self):
+        GroupCourseFactory.create(course=self.course, group=self.group)
+        assert has_group_access(self.user, self.course)
+
+    def test_other_group_course(self):
+        GroupCourseFactory.create(course=self.course)
+        assert not has_group_access(self.user, self.course), 'Only the user group courses count'
+
+    def test_cached_group_courses(self, django_assert_num_queries):
+        GroupCourseFactory.create(course=self.course, group=self.group)
+        assert get_user_group_course_ids(self.user) == {str(self.course.id)}
+        with django_assert_num_queries(0):
+            assert has_group_access(self.user, self.course)
+
+    def test_invalidate_on_group_course_changes(self):
+        assert not has_group_access(self.user, self.course)
+        group_course = GroupCourseFactory.create(course=self.course, group=self.group)
+        assert has_group_access(self.user, self.course), 'Should invalidate on new group course'
+        group_course.delete()
+        assert not has_group_access(self.user, self.course), 'Should invalidate on deleted group course'
+
+    def test_invalidate_on_membership_changes(self):
+        GroupCourseFactory.create(course=self.course, group=self.group)
+        assert has_group_access(self.user, self.course)
+        self.membership.delete()
+        assert not has_group_access(self.user, self.course), 'Should invalidate on deleted membership'
+        MembershipFactory.create(user=self.user, group=self.group)
+        assert has_group_access(self.user, self.course), 'Should invalidate users without membership'
+
+    def test_cached_no_membership(self, django_assert_num_queries):
+        self.membership.delete()
+        assert not has_group_access(self.user, self.course)
+        with django_assert_num_queries(0):
+            assert not has_group_access(self.user, self.course), 'Users without membership should be cached'
+            assert get_user_group_course_ids(self.user) == set()
+
+    def test_no_membership_invalidated_by_rules(self):
+        self.membership.delete()
+        GroupCourseFactory.create(course=self.course, group=self.group)
+        assert not has_group_access(self.user, self.course)
+
+        UserOrganizationMappingFactory.create(user=self.user, organization=self.group.organization)
+        MembershipRuleFactory.create(domain=self.user.email.rsplit('@', 1)[1], group=self.group)
+        assert Membership.create_from_rules(self.user)
+        assert has_group_access(self.user, self.course), 'Should invalidate on automatic membership'
+
+    def test_invalidate_on_group_delete(self):
+        GroupCourseFactory.create(course=self.course, group=self.group)
+        assert has_group_access(self.user, self.course)
+        self.group.delete()
+        assert not has_group_access(self.user, self.course), 'Should invalidate on cascade deletes'
+
+    def test_targeted_invalidation(self, django_assert_num_queries):
+        """
+        Ensure changes only invalidate the related cache entries to keep hit rates high.
+        """
+        other_member = MembershipFactory.create(group=CourseAccessGroupFactory.create()).user
+        GroupCourseFactory.create(course=self.course, group=self.group)
+        assert has_group_access(self.user, self.course)
+        assert not has_group_access(other_member, self.course)
+
+        GroupCourseFactory.create(group=other_member.membership.group)
+        MembershipFactory.create()
+        with django_assert_num_queries(0):
+            assert has_group_access(self.user, self.course), 'Other groups and users changes should keep the cache'
+
+
+@pytest.mark.django_db
+class TestUserHasAccessToCourses:
+    """
+    Tests for the bulk permissions.user_has_access_to_courses helper.
+    """
+
+    @pytest.fixture(autouse=True)
+    def setup(self):
+        self.organization = OrganizationFactory.create()
+        self.group = CourseAccessGroupFactory.create(organization=self.organization)
+        self.user = UserFactory.create()
+        MembershipFactory.create(user=self.user, group=self.group)
+        create_organization_mapping(user=self.user, organization=self.organization)
+
+        org = self.organization.short_name
+        self.public_course = PublicCourseFactory.create(course__org=org).course
+        self.group_course = GroupCourseFactory.create(group=self.group, course__org=org).course
+        self.private_courses = CourseOverviewFactory.create_batch(3, org=org)
+        self.courses = [self.public_course, self.group_course] + self.private_courses
+        for course in self.courses:
+            OrganizationCourse.objects.create(course_id=str(course.id), organization=self.organization)
+
+    def assert_same_as_single_checks(self, user):
+        decisions = user_has_access_to_courses(user, self.courses)
+        assert decisions == {
+            course.id: user_has_access_to_course(user, course) for course in self.courses
+        }, 'Should match the decisions of `user_has_access_to_course`'
+        return decisions
+
+    def test_learner(self):
+        decisions = self.assert_same_as_single_checks(self.user)
+        assert decisions[self.public_course.id]
+        assert decisions[self.group_course.id]
+        assert not any(decisions[course.id] for course in self.private_courses)
+
+    def test_anonymous_user(self):
+        decisions = self.assert_same_as_single_checks(AnonymousUser())
+        assert [course_id for course_id, has_access in decisions.items() if has_access] == [self.public_course.id]
+
+    def test_staff_user(self, django_assert_num_queries):
+        staff = UserFactory.create(is_staff=True)
+        with django_assert_num_queries(0):
+            decisions = user_has_access_to_courses(staff, self.courses)
+        assert all(decisions.values())
+
+    def test_organization_admin(self):
+        admin = UserFactory.create()
+        create_organization_mapping(user=admin, organization=self.organization, is_admin=True)
+        decisions = self.assert_same_as_single_checks(admin)
+        assert all(decisions.values())
+
+    def test_organization_admin_inactive_course_links(self):
+        """
+        Inactive course links should be ignored by both the bulk and the single course checks.
+        """
+        admin = UserFactory.create()
+        create_organization_mapping(user=admin, organization=self.organization, is_admin=True)
+        org = self.organization.short_name
+        inactive_course = CourseOverviewFactory.create(org=org)
+        OrganizationCourse.objects.create(
+            course_id=str(inactive_course.id), organization=self.organization, active=False,
+        )
+        moved_course = CourseOverviewFactory.create(org=org)
+        OrganizationCourse.objects.create(
+            course_id=str(moved_course.id), organization=OrganizationFactory.create(), active=False,
+        )
+        OrganizationCourse.objects.create(course_id=str(moved_course.id), organization=self.organization)
+        self.courses += [inactive_course, moved_course]
+
+        single_decisions = {course.id: user_has_access_to_course(admin, course) for course in self.courses}
+        clear_local_caches()
+        cache.clear()
+        decisions = self.assert_same_as_single_checks(admin)  # The bulk check goes first to fill the caches
+        assert decisions == single_decisions, 'The bulk check should not change the single course decisions'
+        assert not decisions[inactive_course.id], 'Course with an inactive link only has no organization'
+        assert decisions[moved_course.id], 'Inactive links should not count as multiple organizations'
+
+    def test_constant_number_of_queries(self, django_assert_max_num_queries):
+        more_courses = CourseOverviewFactory.create_batch(20, org=self.organization.short_name)
+        for course in more_courses:
+            OrganizationCourse.objects.create(course_id=str(course.id), organization=self.organization)
+
+        # Public courses, membership, group courses index, course organizations and organization admin
+        with django_assert_max_num_queries(5):
+            decisions = user_has_access_to_courses(self.user, self.courses + more_courses)
+        assert len(decisions) == len(self.courses + more_courses)
+
+    def test_reuse_request_cache(self, django_assert_num_queries):
+        start_request_cache()
+        user_has_access_to_courses(self.user, self.courses)
+        with django_assert_num_queries(0):
+            assert user_has_access_to_course(self.user, self.group_course)
+            user_has_access_to_courses(self.user, self.courses)
+
+
+@pytest.mark.django_db
+class TestFilterCoursesForUser:
+    """
+    Tests for the permissions.filter_courses_for_user helper.
+    """
+
+    @pytest.fixture(autouse=True)
+    def setup(self):
+        self.organization = OrganizationFactory.create()
+        self.group = CourseAccessGroupFactory.create(organization=self.organization)
+        self.user = UserFactory.create()
+        MembershipFactory.create(user=self.user, group=self.group)
+        create_organization_mapping(user=self.user, organization=self.organization)
+
+        self.public_course = PublicCourseFactory.create().course
+        self.group_course = GroupCourseFactory.create(group=self.group).course
+        GroupCourseFactory.create(course=self.public_course, group=self.group)  # Should not duplicate rows
+        GroupCourseFactory.create(course=self.public_course)
+        self.private_course = CourseOverviewFactory.create()
+        for course in [self.public_course, self.group_course, self.private_course]:
+            OrganizationCourse.objects.create(course_id=str(course.id), organization=self.organization)
+
+    def get_course_ids(self, user):
+        return sorted(str(course.id) for course in filter_courses_for_user(user, CourseOverview.objects.all()))
+
+    def test_learner(self):
+        assert self.get_course_ids(self.user) == sorted([str(self.public_course.id), str(self.group_course.id)])
+
+    def test_anonymous_user(self):
+        assert self.get_course_ids(AnonymousUser()) == [str(self.public_course.id)]
+
+    def test_staff_user(self):
+        staff = UserFactory.create(is_staff=True)
+        assert self.get_course_ids(staff) == sorted(str(course.id) for course in CourseOverview.objects.all())
+
+    def test_organization_admin(self):
+        admin = UserFactory.create()
+        create_organization_mapping(user=admin, organization=self.organization, is_admin=True)
+        other_org_course = CourseOverviewFactory.create()
+        OrganizationCourse.objects.create(course_id=str(other_org_course.id), organization=OrganizationFactory())
+
+        assert self.get_course_ids(admin) == sorted([
+            str(self.public_course.id),
+            str(self.group_course.id),
+            str(self.private_course.id),
+        ]), 'Org admins should access all the organization courses'
+
+    @pytest.mark.parametrize('is_admin', [False, True])
+    def test_matches_user_has_access_to_course(self, is_admin):
+        user = self.user
+        if is_admin:
+            user = UserFactory.create()
+            create_organization_mapping(user=user, organization=self.organization, is_admin=True)
+        inactive_course = CourseOverviewFactory.create()
+        OrganizationCourse.objects.create(
+            course_id=str(inactive_course.id), organization=self.organization, active=False,
+        )
+
+        courses = CourseOverview.objects.all()
+        expected_ids = sorted(str(course.id) for course in courses if user_has_access_to_course(user, course))
+        assert self.get_course_ids(user) == expected_ids
+        assert str(inactive_course.id) not in expected_ids, 'Inactive course links should be ignored'
+
 
 class TestCommonAuthMixin:
     """
@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for the compiled MembershipRule index.
+"""
+
+
+import pytest
+from tahoe_sites.tests.utils import create_organization_mapping
+
+from course_access_groups.models import Membership
+from course_access_groups.rule_index import MembershipRuleIndex, get_membership_rule_index
+from test_utils.factories import CourseAccessGroupFactory, MembershipRuleFactory, UserFactory
+
+
+@pytest.mark.django_db
+class TestMembershipRuleIndex:
+    """
+    Tests for the MembershipRuleIndex matching.
+    """
+
+    @pytest.fixture(autouse=True)
+    def setup(self):
+        self.group = CourseAccessGroupFactory.create()
+        self.organization_id = self.group.organization_id
+        self.other_group = CourseAccessGroupFactory.create(organization=self.group.organization)
+
+    def build(self, **rules):
+        """
+        Create the rules and compile them.
+
+        :param rules: {domain: group}.
+        """
+        for domain, group in rules.items():
+            MembershipRuleFactory.create(domain=domain, group=group)
+        return MembershipRuleIndex.build(self.organization_id)
+
+    def test_build_with_a_single_query(self, django_assert_num_queries):
+        MembershipRuleFactory.create(domain='example.com', group=self.group)
+        MembershipRuleFactory.create(domain='*.example.org', group=self.group)
+        with django_assert_num_queries(1):
+            MembershipRuleIndex.build(self.organization_id)
+
+    @pytest.mark.parametrize('email_domain, should_match', [
+        ('example.com', True),
+        ('EXAMPLE.com', True),
+        ('sub.example.com', False),
+        ('other.com', False),
+    ])
+    def test_exact_rules(self, email_domain, should_match):
+        index = self.build(**{'example.com': self.group})
+        assert (index.match(email_domain) == self.group.id) == should_match
+
+    @pytest.mark.parametrize('email_domain, should_match', [
+        ('cs.university.edu', True),
+        ('a.cs.university.edu', True),
+        ('university.edu', False),
+        ('otheruniversity.edu', False),
+    ])
+    def test_subdomain_rules(self, email_domain, should_match):
+        index = self.build(**{'*.university.edu': self.group})
+        assert (index.match(email_domain) == self.group.id) == should_match
+
+    def test_exact_rules_precedence(self):
+        MembershipRuleFactory.create(domain='*.university.edu', group=self.group)
+        MembershipRuleFactory.create(domain='cs.university.edu', group=self.other_group)
+        index = MembershipRuleIndex.build(self.organization_id)
+        assert index.match('cs.university.edu') == self.other_group.id
+        assert index.match('math.university.edu') == self.group.id
+
+    def test_longest_subdomain_rule_wins(self):
+        MembershipRuleFactory.create(domain='*.edu', group=self.group)
+        MembershipRuleFactory.create(domain='*.university.edu', group=self.other_group)
+        index = MembershipRuleIndex.build(self.organization_id)
+        assert index.match('cs.university.edu') == self.other_group.id
+        assert index.match('university.edu') == self.group.id
+        assert index.match('college.edu') == self.group.id
+
+    def test_other_organizations_excluded(self):
+        MembershipRuleFactory.create(domain='example.com')
+        index = MembershipRuleIndex.build(self.organization_id)
+        assert index.match('example.com') is None
+
+    def test_match_email(self):
+        index = self.build(**{'example.com': self.group})
+        assert index.match_email('learner@example.com') == self.group.id
+        assert index.match_email('learner@other.com') is None
+
+
+@pytest.mark.django_db
+class TestGetMembershipRuleIndex:
+    """
+    Tests for the cached rule index and its usage by `Membership.create_from_rules`.
+    """
+
+    @pytest.fixture(autouse=True)
+    def setup(self):
+        self.group = CourseAccessGroupFactory.create()
+        self.organization = self.group.organization
+
+    def create_user(self, email):
+        user = UserFactory.create(email=email, is_active=True)
+        create_organization_mapping(user=user, organization=self.organization)
+        return user
+
+    def test_cached_index(self, django_assert_num_queries):
+        index = get_membership_rule_index(self.organization.id)
+        with django_assert_num_queries(0):
+            assert get_membership_rule_index(self.organization.id).exact_rules == index.exact_rules
+
+    def test_invalidate_on_rule_changes(self):
+        assert get_membership_rule_index(self.organization.id).match('example.com') is None
+        rule = MembershipRuleFactory.create(domain='example.com', group=self.group)
+        assert get_membership_rule_index(self.organization.id).match('example.com') == self.group.id, 'New rule'
+        rule.domain = 'example.org'
+        rule.save()
+        assert get_membership_rule_index(self.organization.id).match('example.com') is None, 'Edited rule'
+        rule.delete()
+        assert get_membership_rule_index(self.organization.id).match('example.org') is None, 'Deleted rule'
+
+    def test_invalidate_on_group_delete(self):
+        MembershipRuleFactory.create(domain='example.com', group=self.group)
+        assert get_membership_rule_index(self.organization.id).match('example.com') == self.group.id
+        self.group.delete()
+        assert get_membership_rule_index(self.organization.id).match('example.com') is None
+
+    def test_create_from_rules_subdomain(self):
+        MembershipRuleFactory.create(domain='*.university.edu', group=self.group)
+        membership = Membership.create_from_rules(self.create_user('learner@cs.university.edu'))
+        assert membership.group == self.group
+        assert membership.automatic
+
+    def test_create_from_rules_in_memory(self, django_assert_max_num_queries):
+        """
+        Ensure the rules are queried once for registration waves.
+        """
+        MembershipRuleFactory.create(domain='example.com', group=self.group)
+        Membership.create_from_rules(self.create_user('first@example.com'))
+        user = self.create_user('second@example.com')
+        with django_assert_max_num_queries(10) as captured:
+            assert Membership.create_from_rules(user)
+        rule_queries = [query for query in captured.captured_queries if 'membershiprule' in query['sql']]
+        assert not rule_queries, 'Rules should be matched in memory'
@@ -4,15 +4,23 @@ Tests for signal handlers.
 import logging
 
 import pytest
+from django.db import transaction
+from mock import patch
 
+from course_access_groups.access_index import get_organization_index_version
 from course_access_groups.models import Membership
+from course_access_groups.permissions import get_public_course_ids, public_courses_cache
 from course_access_groups.signals import (
     on_learner_account_activated,
     on_learner_register,
 )
 
 from test_utils.factories import (
+    CourseAccessGroupFactory,
+    CourseOverviewFactory,
+    GroupCourseFactory,
     MembershipRuleFactory,
+    PublicCourseFactory,
     UserFactory,
     UserOrganizationMappingFactory,
 )
@@ -90,3 +98,38 @@ def test_failed_membership_rule_signals(monkeypatch, caplog, receiver_function,
     assert 'Error receiving {signal_name} signal for user'.format(signal_name=signal_name) in caplog.text
     assert 'someone@example.com' in caplog.text
     assert 'AttributeError' in caplog.text
+
+
+@pytest.mark.django_db
+def test_public_course_invalidated_again_on_commit():
+    """
+    Ensure the rows cached by other processes before the transaction commits are discarded on commit.
+    """
+    course = CourseOverviewFactory.create()
+    on_commit_callbacks = []
+    with patch('course_access_groups.cache.transaction.on_commit', side_effect=on_commit_callbacks.append):
+        with transaction.atomic():
+            PublicCourseFactory.create(course=course)
+            public_courses_cache.set(course.id.org, frozenset())  # Cached by another process from the old rows
+
+    assert on_commit_callbacks, 'Should invalidate again on commit'
+    for callback in on_commit_callbacks:
+        callback()
+    assert str(course.id) in get_public_course_ids(course.id.org)
+
+
+@pytest.mark.django_db
+def test_access_index_invalidated_again_on_commit():
+    """
+    Ensure the organization index built by other processes before the transaction commits is discarded on commit.
+    """
+    group = CourseAccessGroupFactory.create()
+    on_commit_callbacks = []
+    with patch('course_access_groups.cache.transaction.on_commit', side_effect=on_commit_callbacks.append):
+        with transaction.atomic():
+            GroupCourseFactory.create(group=group)
+            uncommitted_version = get_organization_index_version(group.organization_id)
+
+    for callback in on_commit_callbacks:
+        callback()
+    assert get_organization_index_version(group.organization_id) != uncommitted_version